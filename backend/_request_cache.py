@@ -0,0 +1,53 @@
+"""
+Request-scoped memoization for Firestore-backed tool functions.
+
+Each learning plan request starts its own cache, so repeated lookups made by
+different agents during one request share a single Firestore round trip while
+separate requests never see each other's data.
+"""
+import functools
+from contextvars import ContextVar, Token
+from typing import Any, Callable, Dict, Hashable, Optional, TypeVar
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+_CACHE: ContextVar[Optional[Dict[Hashable, Any]]] = ContextVar("request_cache", default=None)
+
+
+def start_request_cache() -> Token:
+    """Start an empty cache for the current request; pass the token to end_request_cache."""
+    return _CACHE.set({})
+
+
+def end_request_cache(token: Token) -> None:
+    """Discard the cache started by start_request_cache."""
+    _CACHE.reset(token)
+
+
+def request_cached(func: F) -> F:
+    """Memoize func for the duration of the current request.
+
+    Outside of a request the function is called directly. None results are not
+    cached, so lookups for documents that have not been written yet are retried.
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        cache = _CACHE.get()
+        if cache is None:
+            return func(*args, **kwargs)
+
+        key = (func.__qualname__, args, tuple(sorted(kwargs.items())))
+        try:
+            if key in cache:
+                return cache[key]
+        except TypeError:
+            # Unhashable arguments cannot be cached
+            return func(*args, **kwargs)
+
+        result = func(*args, **kwargs)
+        if result is not None:
+            cache[key] = result
+        return result
+
+    return wrapper
@@ -1,27 +1,72 @@
 import os
-from typing import Optional
+from dataclasses import dataclass, field
+from typing import Any, Callable, ClassVar, Dict, Optional, Tuple
 from dotenv import load_dotenv
 
-# Load environment variables
-load_dotenv()
+# Load environment variables, unless the environment is already provided
+# (e.g. by the container orchestrator) and DOTENV_SKIP=1 is set
+if os.getenv("DOTENV_SKIP") != "1":
+    load_dotenv()
 
+# Snapshot of the environment taken once at import; Config reads from this
+_ENV: Dict[str, str] = dict(os.environ)
+
+def refresh_env_cache() -> Dict[str, str]:
+    """Re-read os.environ into the environment snapshot.
+    
+    Config fields are read from the snapshot when a Config is constructed, so the
+    module-level config keeps its values; build a new Config() to pick up changes.
+    """
+    _ENV.clear()
+    _ENV.update(os.environ)
+    return _ENV
+
+def _env(name: str, default: Optional[str] = None, cast: Callable[[Optional[str]], Any] = lambda v: v) -> Any:
+    """Dataclass field whose default is read from the environment snapshot."""
+    return field(default_factory=lambda: cast(_ENV.get(name, default)))
+
+@dataclass(frozen=True, slots=True)
 class Config:
     """Configuration class for Know-Flow backend"""
     
     # Firebase Configuration
-    FIREBASE_PROJECT_ID: str = os.getenv("FIREBASE_PROJECT_ID", "")
-    FIREBASE_CLIENT_EMAIL: str = os.getenv("FIREBASE_CLIENT_EMAIL", "")
-    FIREBASE_PRIVATE_KEY: str = os.getenv("FIREBASE_PRIVATE_KEY", "")
-    FIRESTORE_PATH: Optional[str] = os.getenv("FIRESTORE_PATH")
+    FIREBASE_PROJECT_ID: str = _env("FIREBASE_PROJECT_ID", "")
+    FIREBASE_CLIENT_EMAIL: str = _env("FIREBASE_CLIENT_EMAIL", "")
+    # Stored with escaped newlines in .env files; decoded once when read
+    FIREBASE_PRIVATE_KEY: str = _env("FIREBASE_PRIVATE_KEY", "", lambda v: v.replace('\\n', '\n'))
+    FIRESTORE_PATH: Optional[str] = _env("FIRESTORE_PATH")
     
     # API Keys
-    OPENAI_API_KEY: str = os.getenv("OPENAI_API_KEY", "")
-    ANTHROPIC_API_KEY: str = os.getenv("ANTHROPIC_API_KEY", "")
+    OPENAI_API_KEY: str = _env("OPENAI_API_KEY", "")
+    ANTHROPIC_API_KEY: str = _env("ANTHROPIC_API_KEY", "")
     
     # Server Configuration
-    PORT: int = int(os.getenv("PORT", "8000"))
-    HOST: str = os.getenv("HOST", "0.0.0.0")
-    DEBUG: bool = os.getenv("DEBUG", "false").lower() == "true"
+    PORT: int = _env("PORT", "8000", int)
+    HOST: str = _env("HOST", "0.0.0.0")
+    DEBUG: bool = _env("DEBUG", "false", lambda v: v.lower() == "true")
+    # Comma-separated browser origins allowed to call the API
+    ALLOWED_ORIGINS: Tuple[str, ...] = _env(
+        "ALLOWED_ORIGINS", "http://localhost:3000",
+        lambda v: tuple(origin.strip() for origin in v.split(",") if origin.strip())
+    )
+    
+    # Rate Limiting Configuration; without REDIS_URL each worker enforces its own limit
+    REDIS_URL: Optional[str] = _env("REDIS_URL")
+    RATE_LIMIT_REQUESTS: int = _env("RATE_LIMIT_REQUESTS", "100", int)
+    RATE_LIMIT_WINDOW_SECONDS: int = _env("RATE_LIMIT_WINDOW_SECONDS", "60", int)
+    # Clients tracked per process without Redis; least recently seen are evicted beyond this
+    RATE_LIMIT_MAX_CLIENTS: int = _env("RATE_LIMIT_MAX_CLIENTS", "100000", int)
+    
+    # OpenAI usage limits for content generation, matching the account's rate limits
+    OPENAI_MAX_CONCURRENT_REQUESTS: int = _env("OPENAI_MAX_CONCURRENT_REQUESTS", "5", int)
+    OPENAI_REQUESTS_PER_MINUTE: int = _env("OPENAI_REQUESTS_PER_MINUTE", "200", int)
+    OPENAI_TOKENS_PER_MINUTE: int = _env("OPENAI_TOKENS_PER_MINUTE", "40000", int)
+    
+    # Background learning plan generation: a batch starts when full or after the wait
+    PLAN_BATCH_SIZE: int = _env("PLAN_BATCH_SIZE", "10", int)
+    PLAN_BATCH_MAX_WAIT_SECONDS: float = _env("PLAN_BATCH_MAX_WAIT_SECONDS", "5", float)
+    # A prompt processing for longer than this is assumed abandoned and is generated again
+    PLAN_PROCESSING_TIMEOUT_SECONDS: float = _env("PLAN_PROCESSING_TIMEOUT_SECONDS", "1800", float)
     
     # Database Configuration
     DATABASE_COLLECTION_USERS: str = "users"
@@ -30,43 +75,51 @@ class Config:
     DATABASE_COLLECTION_KNOWLEDGE_GRAPHS: str = "knowledgeGraphs"
     
     # Content Generation Configuration
-    MAX_LESSONS_PER_PLAN: int = int(os.getenv("MAX_LESSONS_PER_PLAN", "10"))
-    MAX_EXTERNAL_RESOURCES_PER_LESSON: int = int(os.getenv("MAX_EXTERNAL_RESOURCES_PER_LESSON", "5"))
+    MAX_LESSONS_PER_PLAN: int = _env("MAX_LESSONS_PER_PLAN", "10", int)
+    MAX_EXTERNAL_RESOURCES_PER_LESSON: int = _env("MAX_EXTERNAL_RESOURCES_PER_LESSON", "5", int)
     
     # Validation
-    @classmethod
-    def validate(cls) -> bool:
+    _REQUIRED: ClassVar[Tuple[str, ...]] = (
+        "FIREBASE_PROJECT_ID",
+        "FIREBASE_CLIENT_EMAIL",
+        "FIREBASE_PRIVATE_KEY",
+        "OPENAI_API_KEY",
+    )
+    _validated: bool = field(default=False, init=False, repr=False, compare=False)
+    
+    # Built on first use by get_firebase_config
+    _firebase_config: Optional[dict] = field(default=None, init=False, repr=False, compare=False)
+    
+    def validate(self) -> bool:
         """Validate that all required configuration is present"""
-        required_fields = [
-            "FIREBASE_PROJECT_ID",
-            "FIREBASE_CLIENT_EMAIL", 
-            "FIREBASE_PRIVATE_KEY",
-            "OPENAI_API_KEY"
-        ]
-        
-        missing_fields = []
-        for field in required_fields:
-            if not getattr(cls, field):
-                missing_fields.append(field)
+        if self._validated:
+            return True
         
+        missing_fields = [name for name in self._REQUIRED if not getattr(self, name)]
         if missing_fields:
             raise ValueError(f"Missing required configuration: {missing_fields}")
         
+        object.__setattr__(self, "_validated", True)
         return True
     
-    @classmethod
-    def get_firebase_config(cls) -> dict:
-        """Get Firebase configuration dictionary"""
-        return {
-            "type": "service_account",
-            "project_id": cls.FIREBASE_PROJECT_ID,
-            "client_email": cls.FIREBASE_CLIENT_EMAIL,
-            "private_key": cls.FIREBASE_PRIVATE_KEY.replace('\\n', '\n'),
-            "auth_uri": "https://accounts.google.com/o/oauth2/auth",
-            "token_uri": "https://oauth2.googleapis.com/token",
-            "auth_provider_x509_cert_url": "https://www.googleapis.com/oauth2/v1/certs",
-            "client_x509_cert_url": f"https://www.googleapis.com/robot/v1/metadata/x509/{cls.FIREBASE_CLIENT_EMAIL}"
-        }
+    def get_firebase_config(self) -> dict:
+        """Get Firebase configuration dictionary.
+        
+        The dictionary is built once and the same object is returned on every call,
+        so callers must not mutate it.
+        """
+        if self._firebase_config is None:
+            object.__setattr__(self, "_firebase_config", {
+                "type": "service_account",
+                "project_id": self.FIREBASE_PROJECT_ID,
+                "client_email": self.FIREBASE_CLIENT_EMAIL,
+                "private_key": self.FIREBASE_PRIVATE_KEY,
+                "auth_uri": "https://accounts.google.com/o/oauth2/auth",
+                "token_uri": "https://oauth2.googleapis.com/token",
+                "auth_provider_x509_cert_url": "https://www.googleapis.com/oauth2/v1/certs",
+                "client_x509_cert_url": f"https://www.googleapis.com/robot/v1/metadata/x509/{self.FIREBASE_CLIENT_EMAIL}"
+            })
+        return self._firebase_config
 
 # Global config instance
 config = Config()
@@ -1,28 +1,27 @@
 import logging
 import os
-from datetime import datetime, timedelta
-from typing import Dict, Any, Optional, List
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import Dict, Any, Optional, List, Tuple, Awaitable, AsyncIterator, Callable, TYPE_CHECKING
 import asyncio
+import httpx
 import json
+import orjson
+import re
+import time
+from functools import wraps
+from weakref import WeakKeyDictionary
 
-from agno.agent import Agent
-from agno.models.anthropic import Claude
-from agno.models.openai import OpenAIChat
-from agno.team.team import Team
-from agno.tools.googlesearch import GoogleSearchTools
-from agno.utils.pprint import pprint_run_response
-
-from data.utils import (
-    get_knowledge_graph,
-    get_lesson_plan,
-    parse_json,
-    write_knowledge_graph,
-    write_lesson_plan,
-    fetch_user_id,
-)
-from data.model import KnowledgeGraph, LessonPlan
+from data.model import LessonPlan, parse_json
+from config import config
+from _request_cache import end_request_cache, start_request_cache
+from rate_limit import OpenAIRateLimiter
 
-from dotenv import load_dotenv
+if TYPE_CHECKING:
+    from agno.agent import Agent
+    from agno.models.anthropic import Claude
+    from agno.models.openai import OpenAIChat
+    from agno.team.team import Team
 
 # Configure logging
 logging.basicConfig(
@@ -31,279 +30,392 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Load environment variables
-load_dotenv()
-
 # Verify required environment variables
 required_env_vars = ['OPENAI_API_KEY', 'ANTHROPIC_API_KEY']
-missing_vars = [key for key in required_env_vars if not os.getenv(key)]
-if missing_vars:
+if not all(getattr(config, key) for key in required_env_vars):
+    missing_vars = [key for key in required_env_vars if not getattr(config, key)]
     logger.warning(f"Missing environment variables: {missing_vars}")
 
-# Enhanced Content Generator Agent
-content_generator_agent = Agent(
-    name="Content Generator",
-    role="Creates and refines learning materials and answers user questions",
-    instructions=[
-        "Parse the instruction for the user_id, source_prompt, and refined_instruction",
-        "Begin by generating a comprehensive learning plan based on the users knowledge history and learning pace",
-        "Ask the researcher to provide additional external resources",
-        "Utilize the provided resources to be included in the following output",
-        """Your output must adhere to the following JSON Structure:\n
-        {'user_id': 'str',\n
-        'plan_id': 'str', \n 
-        'plan_title': 'title of new plan', \n
-        'description': 'description of plan', \n
-        'created_at': 'datetime', \n 
-        'last_accessed': 'datetime', \n 
-        'status': 'active or archived: default to active', \n 
-        'source_prompt': 'prompt from the initial query', \n
-        'lessons': [{'lesson_id':str, 'title':'str', 'objectives':['str'], 'content': 'str', 'external_resources':['str'], 'order': 'int'}]""",
-        "Ensure that the JSON output contains a list of lessons with objectives in mind. This is the main priority.",
-        "Hand off the information to Data Inputter to write to the database",
-        "Consider the user's learning style and adapt content accordingly",
-        "Include interactive elements and practical exercises in each lesson",
-        "Ensure content is engaging and follows modern pedagogical principles"
-    ],
-    description="You generate comprehensive syllabi (lesson plans) from vague prompts with enhanced user experience",
-    structured_outputs=True,
-    add_datetime_to_instructions=True,
+# Maximum number of concurrent per-lesson research searches
+RESEARCH_CONCURRENCY = 5
+
+# Links extracted from research agent responses
+URL_PATTERN = re.compile(r"https?://[^\s<>()\[\]'\"]+")
+
+# Names of transient errors worth retrying
+_RETRYABLE_ERRORS = frozenset({
+    'ConnectionError',
+    'TimeoutError',
+    'RateLimitError',
+    'ServiceUnavailableError'
+})
+
+# Completion tokens reserved from the OpenAI token budget for each agent call
+OPENAI_COMPLETION_TOKENS = 2000
+
+# Instructions shared across agents and teams
+COMMON_INSTRUCTIONS = (
+    "Handle errors gracefully and provide meaningful feedback",
 )
 
+# Knowledge graph output shapes for the agent instructions, serialized compactly to keep
+# prompts short. Lesson plans use LessonPlan as a response_model instead.
+CONCEPT_NODE_SCHEMA = json.dumps({
+    "concept_id": "str",
+    "name": "concept name",
+    "description": "str",
+    "mastery_level": "int between 0-100",
+    "last_reviewed": "datetime",
+    "next_review": "datetime",
+    "source_lesson_id": "str",
+    "difficulty": "beginner|intermediate|advanced",
+    "estimated_time": "int in minutes",
+    "prerequisites": ["concept_id"],
+    "related_concepts": ["concept_id"],
+}, separators=(",", ":"))
+
+CONCEPT_EDGE_SCHEMA = json.dumps({
+    "edge_id": "str",
+    "source_concept_id": "str",
+    "target_concept_id": "str",
+    "relationship_type": "related_to, prerequisite_for, or part_of",
+    "strength": "float between 0-1",
+    "bidirectional": "boolean",
+}, separators=(",", ":"))
+
+# Agents and teams are built by the get_* factories below, so importing this module
+# does not load agno or construct any model clients. Agents and teams keep run state,
+# and plans are generated concurrently, so every run builds its own.
+
+def _in_thread(tool: Callable[..., Any]) -> Callable[..., Awaitable[Any]]:
+    """Async version of a blocking tool, run in a worker thread.
+    
+    Agents call synchronous tools inline on the event loop, which would stall every
+    other request while a Firestore read or a web search is in progress. The wrapper
+    keeps the tool's name, signature and docstring, which agno uses for its schema.
+    """
+    @wraps(tool)
+    async def wrapper(*args, **kwargs):
+        return await asyncio.to_thread(tool, *args, **kwargs)
+    
+    return wrapper
+
+_http_clients: "WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = WeakKeyDictionary()
+
+def get_http_client() -> Optional[httpx.AsyncClient]:
+    """HTTP connection pool for model API calls on the running event loop.
+    
+    Returns None outside of an event loop, leaving the SDK to create its own client.
+    """
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+    client = _http_clients.get(loop)
+    if client is None or client.is_closed:
+        client = _http_clients[loop] = httpx.AsyncClient(limits=httpx.Limits(max_keepalive_connections=50))
+    return client
+
+async def close_http_client() -> None:
+    """Close the running event loop's connection pool, if get_http_client opened one."""
+    client = _http_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+def _run(coroutine: Awaitable[Any]) -> Any:
+    """asyncio.run, closing the loop's connection pool before the loop goes away."""
+    async def main() -> Any:
+        try:
+            return await coroutine
+        finally:
+            await close_http_client()
+    
+    return asyncio.run(main())
+
+# Every agent and team gets its own model, because agno writes per-run settings such
+# as the response format and tools onto it; the OpenAI models share get_http_client's
+# pool, while Claude takes no HTTP client and uses the Anthropic SDK's own
+def get_openai_model() -> "OpenAIChat":
+    from agno.models.openai import OpenAIChat
+
+    return OpenAIChat(http_client=get_http_client())
+
+def get_claude_model() -> "Claude":
+    from agno.models.anthropic import Claude
+
+    return Claude(id="claude-3-7-sonnet-latest")
+
+# Enhanced Content Generator Agent
+def get_content_generator_agent() -> "Agent":
+    from agno.agent import Agent
+
+    return Agent(
+        name="Content Generator",
+        model=get_openai_model(),
+        role="Creates and refines learning materials and answers user questions",
+        instructions=[
+            "Parse the instruction for the user_id, source_prompt, and refined_instruction",
+            "Begin by generating a comprehensive learning plan based on the users knowledge history and learning pace",
+            "Include at least one reputable external resource URL for each lesson",
+            "Return a LessonPlan object.",
+            "Ensure that the JSON output contains a list of lessons with objectives in mind. This is the main priority.",
+            "Consider the user's learning style and adapt content accordingly",
+            "Include interactive elements and practical exercises in each lesson",
+            "Ensure content is engaging and follows modern pedagogical principles"
+        ],
+        description="You generate comprehensive syllabi (lesson plans) from vague prompts with enhanced user experience",
+        response_model=LessonPlan,
+        structured_outputs=True,
+        add_datetime_to_instructions=True,
+    )
+
 # Enhanced Research Agent
-research_agent = Agent(
-    name="Researcher",
-    role="Find relevant content and information for a given topic",
-    instructions=[
-        "Search the web for relevant content for a given topic",
-        "Only include the most relevant results, between 2-3 links per lesson",
-        "Verify that the sources are reliable and educational",
-        "Prioritize recent and authoritative sources",
-        "Include diverse perspectives when appropriate",
-        "Validate information accuracy and relevance",
-        "Consider different learning levels (beginner, intermediate, advanced)"
-    ],
-    tools=[GoogleSearchTools()],
-)
+def get_research_agent() -> "Agent":
+    from agno.agent import Agent
+    from search_tools import CachedGoogleSearchTools
 
-# Enhanced Content Writer Agent
-content_writer_agent = Agent(
-    name="Data Writer",
-    role="Input data into the database",
-    instructions=[
-        """Ensure that the provided message follows this structure:\n
-        {'user_id': 'str',\n
-        'plan_id': 'str', \n 
-        'plan_title': 'title of new plan', \n
-        'description': 'description of plan', \n
-        'created_at': 'datetime', \n 
-        'last_accessed': 'datetime', \n 
-        'status': 'active or archived: default to active', \n 
-        'source_prompt': 'prompt from the initial query', \n
-        'lessons': [{'lesson_id':str, 'title':'str', 'objectives':['str'], 'content': 'str', 'external_resources':['str'], 'order': 'int'}]""",
-        "Use the write_lesson_plan tool to add this information to the database",
-        "If the user does not have an ID, use fetch_user_id",
-        "Validate the data structure before writing to the database",
-        "Ensure all required fields are present and properly formatted",
-        "Handle database errors gracefully and provide meaningful feedback"
-    ],
-    tools=[write_lesson_plan, fetch_user_id],
-)
+    return Agent(
+        name="Researcher",
+        model=get_openai_model(),
+        role="Find relevant content and information for a given topic",
+        instructions=[
+            "Search the web for relevant content for a given topic",
+            "Only include the most relevant results, between 2-3 links per lesson",
+            "Verify that the sources are reliable and educational",
+            "Prioritize recent and authoritative sources",
+            "Include diverse perspectives when appropriate",
+            "Validate information accuracy and relevance",
+            "Consider different learning levels (beginner, intermediate, advanced)"
+        ],
+        tools=[_in_thread(CachedGoogleSearchTools().google_search)],
+    )
 
 # Enhanced Content Generation Team
-content_generation_agent = Team(
-    name="Content Generator Leader",
-    mode="coordinate",
-    members=[content_generator_agent, research_agent, content_writer_agent],
-    model=OpenAIChat(),
-    instructions=[
-        """Ensure that the following information is included in the task description: \n
-        source_prompt: 'original user prompt'\n
-        user_id: 'user_id'\n
-        refined instruction: 'your instruction'""",
-        "Begin by generating a comprehensive learning plan based on the users knowledge history and learning pace",
-        "Delegate tasks to the content generator and data writer to format and append the data to memory",
-        "Ensure that the data is formatted to JSON when provided to the data writer",
-        "Ensure the data is inputted to the database using get_lesson_plan with user_id and plan_id",
-        "If the data is not returned, then ask the inputter to try again",
-        "Return the plan_id alongside the generated plan message",
-        "Handle errors gracefully and provide meaningful feedback",
-        "Ensure content quality and educational value",
-        "Optimize for user engagement and learning outcomes"
-    ],
-    tools=[get_lesson_plan],
-    description="You generate comprehensive syllabi (lesson plans) from vague prompts with enhanced quality control",
-    add_datetime_to_instructions=True,
-    add_member_tools_to_system_message=True,
-    enable_agentic_context=True,
-    share_members_responses=True,
-    show_members_responses=True,
-)
+def get_content_generation_agent() -> "Team":
+    from agno.team.team import Team
+
+    return Team(
+        name="Content Generator Leader",
+        mode="coordinate",
+        members=[get_content_generator_agent()],
+        model=get_openai_model(),
+        instructions=[
+            """Ensure that the following information is included in the task description: \n
+            source_prompt: 'original user prompt'\n
+            user_id: 'user_id'\n
+            refined instruction: 'your instruction'""",
+            "Begin by generating a comprehensive learning plan based on the users knowledge history and learning pace",
+            "Delegate the task to the content generator",
+            "Return the LessonPlan produced by the content generator",
+            *COMMON_INSTRUCTIONS,
+            "Ensure content quality and educational value",
+            "Optimize for user engagement and learning outcomes"
+        ],
+        description="You generate comprehensive syllabi (lesson plans) from vague prompts with enhanced quality control",
+        response_model=LessonPlan,
+        add_datetime_to_instructions=True,
+        add_member_tools_to_system_message=True,
+        enable_agentic_context=True,
+        share_member_interactions=config.DEBUG,
+        show_members_responses=config.DEBUG,
+    )
 
 # Enhanced Graph Generator Agent
-graph_generator_agent = Agent(
-    name="Graph Generator",
-    model=OpenAIChat(),
-    instructions=[
-        "Gather the lesson plan information using get_lesson_plan from the user_id and plan_id",
-        "Parse the information and understand each lessons content and how they relate to each other",
-        """Generate node information in the following JSON Format:\n
-        {'concept_id': 'str', \n
-        'name': 'concept name', \n
-        'description': 'str', \n
-        'mastery_level': 'int between 0-100', \n
-        'last_reviewed': 'datetime', \n
-        'next_review': 'datetime', \n
-        'source_lesson_id': 'str',
-        'difficulty': 'beginner|intermediate|advanced',
-        'estimated_time': 'int in minutes',
-        'prerequisites': ['concept_id'],
-        'related_concepts': ['concept_id']
-        }
-        """,
-        """Generate edge information in the following JSON format:\n 
-        {'edge_id': 'str',
-        'source_concept_id': 'str',
-        'target_concept_id': 'str'
-        'relationship_type': 'related_to, prerequisite_for, or part_of',
-        'strength': 'float between 0-1',
-        'bidirectional': 'boolean'}
-        """,
-        "Ensure all concept relationships are logical and educational",
-        "Handle errors gracefully and provide meaningful feedback",
-        "Create a comprehensive knowledge graph that supports adaptive learning",
-        "Consider learning paths and progression sequences"
-    ],
-    tools=[get_lesson_plan],
-    structured_outputs=True,
-    use_json_mode=True,
-    add_datetime_to_instructions=True,
-)
+def get_graph_generator_agent() -> "Agent":
+    from agno.agent import Agent
+    from data.utils import get_lesson_plan
+
+    return Agent(
+        name="Graph Generator",
+        model=get_openai_model(),
+        instructions=[
+            "Use the lesson_plan provided in the task; only if it is missing, gather it using get_lesson_plan from the user_id and plan_id",
+            "Parse the information and understand each lessons content and how they relate to each other",
+            f"Generate node information in the following JSON format: {CONCEPT_NODE_SCHEMA}",
+            f"Generate edge information in the following JSON format: {CONCEPT_EDGE_SCHEMA}",
+            "Ensure all concept relationships are logical and educational",
+            *COMMON_INSTRUCTIONS,
+            "Create a comprehensive knowledge graph that supports adaptive learning",
+            "Consider learning paths and progression sequences"
+        ],
+        tools=[_in_thread(get_lesson_plan)],
+        structured_outputs=True,
+        use_json_mode=True,
+        add_datetime_to_instructions=True,
+    )
 
 # Enhanced Graph Writer Agent
-graph_writer_agent = Agent(
-    name="Graph Writer",
-    model=OpenAIChat(),
-    instructions=[
-        "Parse the message for user_id, list of edges, and list of nodes from the graph generator",
-        "Using write_knowledge_graph, write the generated user knowledge graph to the database",
-        "Validate the data structure before writing",
-        "Handle any database errors gracefully",
-        "Ensure data integrity and consistency",
-        "Optimize graph structure for efficient querying"
-    ],
-    tools=[write_knowledge_graph],
-    add_datetime_to_instructions=True,
-)
+def get_graph_writer_agent() -> "Agent":
+    from agno.agent import Agent
+    from data.utils import write_knowledge_graph
+
+    return Agent(
+        name="Graph Writer",
+        model=get_openai_model(),
+        instructions=[
+            "Parse the message for user_id, list of edges, and list of nodes from the graph generator",
+            "Using write_knowledge_graph, write the generated user knowledge graph to the database",
+            "Validate the data structure before writing",
+            "Handle any database errors gracefully",
+            "Ensure data integrity and consistency",
+            "Optimize graph structure for efficient querying"
+        ],
+        tools=[_in_thread(write_knowledge_graph)],
+        add_datetime_to_instructions=True,
+    )
 
 # Enhanced Knowledge Graph Team
-knowledge_graph_agent = Team(
-    name="Knowledge Graph Leader",
-    model=OpenAIChat(),
-    members=[graph_generator_agent, graph_writer_agent],
-    instructions=[
-        "Determine if the knowledge graph should be updated or generated from scratch by using get_knowledge_graph with the user_id",
-        "Delegate tasks to the graph generator to format the data for the graph writer",
-        "Then hand the graph writer the content alongside the user_id for appending to memory",
-        "Ensure the data is inputted to the database using get_knowledge_graph with user_id",
-        "If the data is not returned, then ask the inputter to try again",
-        "Return the plan_id alongside the generated plan message",
-        "Handle errors gracefully and provide meaningful feedback",
-        "Optimize graph structure for learning analytics",
-        "Ensure graph scalability and performance"
-    ],
-    tools=[get_knowledge_graph],
-    add_datetime_to_instructions=True,
-    add_member_tools_to_system_message=True,
-    enable_agentic_context=True,
-    share_members_responses=True,
-    show_members_responses=True,
-)
+def get_knowledge_graph_agent() -> "Team":
+    from agno.team.team import Team
+    from data.utils import get_knowledge_graph
+
+    return Team(
+        name="Knowledge Graph Leader",
+        model=get_openai_model(),
+        members=[get_graph_generator_agent(), get_graph_writer_agent()],
+        instructions=[
+            "Determine if the knowledge graph should be updated or generated from scratch by using get_knowledge_graph with the user_id",
+            "Delegate tasks to the graph generator to format the data for the graph writer",
+            "Then hand the graph writer the content alongside the user_id for appending to memory",
+            "Ensure the data is inputted to the database using get_knowledge_graph with user_id",
+            "If the data is not returned, then ask the inputter to try again",
+            "Return the plan_id alongside the generated plan message",
+            *COMMON_INSTRUCTIONS,
+            "Optimize graph structure for learning analytics",
+            "Ensure graph scalability and performance"
+        ],
+        tools=[_in_thread(get_knowledge_graph)],
+        add_datetime_to_instructions=True,
+        add_member_tools_to_system_message=True,
+        enable_agentic_context=True,
+        share_member_interactions=config.DEBUG,
+        show_members_responses=config.DEBUG,
+    )
 
 # Enhanced Learning Orchestrator
-leader = Team(
-    name="Learning Orchestrator",
-    mode="coordinate",
-    members=[content_generation_agent, knowledge_graph_agent],
-    model=Claude(id="claude-3-7-sonnet-latest"),
-    description="You are the central coordinator in charge of determining user intent from input and delegating tasks to other agents with enhanced intelligence",
-    instructions=[
-        "Given a prompt, determine what the user wants with high accuracy",
-        "If the user wants to learn about a new topic, ask the content generator to curate a learning plan",
-        """Whenever delegating a task to a member,
-        always include the original prompt and the user_id in this format:\n
-        source_prompt: 'original user prompt'\n
-        user_id: 'user_id'\n
-        refined instruction: 'your instruction'""",
-        "Then ask the graph agent to generate a knowledge graph of the lesson plan",
-        "Handle errors gracefully and provide meaningful feedback to users",
-        "Ensure all tasks are completed successfully before proceeding",
-        "Optimize for user experience and learning outcomes",
-        "Provide progress updates and estimated completion times",
-        "Adapt strategies based on user feedback and performance"
-    ],
-    add_datetime_to_instructions=True,
-    add_member_tools_to_system_message=True,
-    enable_agentic_context=True,
-    share_members_responses=True,
-    show_members_responses=True,
-)
+# Only used by generate_learning_plan for prompts whose intent has to be determined
+# first; the knowledge graph is generated afterwards by generate_learning_plan.
+def get_leader() -> "Team":
+    from agno.team.team import Team
+
+    return Team(
+        name="Learning Orchestrator",
+        mode="coordinate",
+        members=[get_content_generation_agent()],
+        model=get_claude_model(),
+        response_model=LessonPlan,
+        description="You are the central coordinator in charge of determining user intent from input and delegating tasks to other agents with enhanced intelligence",
+        instructions=[
+            "Given a prompt, determine what the user wants with high accuracy",
+            "If the user wants to learn about a new topic, ask the content generator to curate a learning plan",
+            """Whenever delegating a task to a member,
+            always include the original prompt and the user_id in this format:\n
+            source_prompt: 'original user prompt'\n
+            user_id: 'user_id'\n
+            refined instruction: 'your instruction'""",
+            "Return the LessonPlan produced by the content generator",
+            *COMMON_INSTRUCTIONS,
+            "Ensure all tasks are completed successfully before proceeding",
+            "Optimize for user experience and learning outcomes",
+            "Provide progress updates and estimated completion times",
+            "Adapt strategies based on user feedback and performance"
+        ],
+        add_datetime_to_instructions=True,
+        add_member_tools_to_system_message=True,
+        enable_agentic_context=True,
+        share_member_interactions=config.DEBUG,
+        show_members_responses=config.DEBUG,
+    )
 
 # New: Learning Analytics Agent
-learning_analytics_agent = Agent(
-    name="Learning Analytics",
-    model=OpenAIChat(),
-    instructions=[
-        "Analyze user learning patterns and performance data",
-        "Generate insights about learning effectiveness and areas for improvement",
-        "Recommend personalized learning strategies",
-        "Track progress and identify knowledge gaps",
-        "Provide actionable feedback for continuous improvement"
-    ],
-    structured_outputs=True,
-    add_datetime_to_instructions=True,
-)
+def get_learning_analytics_agent() -> "Agent":
+    from agno.agent import Agent
+
+    return Agent(
+        name="Learning Analytics",
+        model=get_openai_model(),
+        instructions=[
+            "Analyze user learning patterns and performance data",
+            "Generate insights about learning effectiveness and areas for improvement",
+            "Recommend personalized learning strategies",
+            "Track progress and identify knowledge gaps",
+            "Provide actionable feedback for continuous improvement"
+        ],
+        structured_outputs=True,
+        add_datetime_to_instructions=True,
+    )
 
 # New: Adaptive Learning Agent
-adaptive_learning_agent = Agent(
-    name="Adaptive Learning",
-    model=OpenAIChat(),
-    instructions=[
-        "Adapt learning content based on user performance and preferences",
-        "Adjust difficulty levels dynamically",
-        "Personalize learning paths for individual users",
-        "Optimize content delivery timing and format",
-        "Implement spaced repetition and adaptive testing"
-    ],
-    structured_outputs=True,
-    add_datetime_to_instructions=True,
-)
+def get_adaptive_learning_agent() -> "Agent":
+    from agno.agent import Agent
+
+    return Agent(
+        name="Adaptive Learning",
+        model=get_openai_model(),
+        instructions=[
+            "Adapt learning content based on user performance and preferences",
+            "Adjust difficulty levels dynamically",
+            "Personalize learning paths for individual users",
+            "Optimize content delivery timing and format",
+            "Implement spaced repetition and adaptive testing"
+        ],
+        structured_outputs=True,
+        add_datetime_to_instructions=True,
+    )
 
 # Enhanced Learning Orchestrator with Analytics
-enhanced_leader = Team(
-    name="Enhanced Learning Orchestrator",
-    mode="coordinate",
-    members=[content_generation_agent, knowledge_graph_agent, learning_analytics_agent, adaptive_learning_agent],
-    model=Claude(id="claude-3-7-sonnet-latest"),
-    description="Advanced learning coordination with analytics and adaptive capabilities",
-    instructions=[
-        "Coordinate all learning activities with enhanced intelligence",
-        "Integrate analytics for continuous improvement",
-        "Adapt learning strategies based on real-time data",
-        "Ensure optimal learning outcomes for each user",
-        "Provide comprehensive learning insights and recommendations"
-    ],
-    add_datetime_to_instructions=True,
-    add_member_tools_to_system_message=True,
-    enable_agentic_context=True,
-    share_members_responses=True,
-    show_members_responses=True,
-)
+def get_enhanced_leader() -> "Team":
+    from agno.team.team import Team
+
+    return Team(
+        name="Enhanced Learning Orchestrator",
+        mode="coordinate",
+        members=[get_content_generation_agent(), get_knowledge_graph_agent(), get_learning_analytics_agent(), get_adaptive_learning_agent()],
+        model=get_claude_model(),
+        description="Advanced learning coordination with analytics and adaptive capabilities",
+        instructions=[
+            "Coordinate all learning activities with enhanced intelligence",
+            "Integrate analytics for continuous improvement",
+            "Adapt learning strategies based on real-time data",
+            "Ensure optimal learning outcomes for each user",
+            "Provide comprehensive learning insights and recommendations"
+        ],
+        add_datetime_to_instructions=True,
+        add_member_tools_to_system_message=True,
+        enable_agentic_context=True,
+        share_member_interactions=config.DEBUG,
+        show_members_responses=config.DEBUG,
+    )
+
+_openai_limiters: "WeakKeyDictionary[asyncio.AbstractEventLoop, OpenAIRateLimiter]" = WeakKeyDictionary()
+
+def get_openai_limiter() -> OpenAIRateLimiter:
+    """OpenAI rate limiter for the running event loop, shared by every request on it."""
+    loop = asyncio.get_running_loop()
+    limiter = _openai_limiters.get(loop)
+    if limiter is None:
+        limiter = _openai_limiters[loop] = OpenAIRateLimiter(
+            max_concurrent_requests=config.OPENAI_MAX_CONCURRENT_REQUESTS,
+            requests_per_minute=config.OPENAI_REQUESTS_PER_MINUTE,
+            tokens_per_minute=config.OPENAI_TOKENS_PER_MINUTE,
+        )
+    return limiter
+
+def _estimate_tokens(message: str) -> int:
+    """Rough token count of a message plus the completion reserved for its reply."""
+    return len(message) // 4 + 1 + OPENAI_COMPLETION_TOKENS
+
+async def _arun(agent: Any, message: str) -> Any:
+    """Run an OpenAI-backed agent or team once it fits within the OpenAI rate limits."""
+    async with get_openai_limiter().reserve(_estimate_tokens(message)):
+        return await agent.arun(message, stream=False)
 
 def generate_learning_plan(user_id: str, prompt: str, context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
     """
     Generate a learning plan for a user based on their prompt with enhanced capabilities.
     
+    Synchronous entry point; runs generate_learning_plan_async on a fresh event loop.
+    
     Args:
         user_id: The user's unique identifier
         prompt: The learning prompt or question
@@ -312,56 +424,112 @@ def generate_learning_plan(user_id: str, prompt: str, context: Optional[Dict[str
     Returns:
         Dictionary containing the generated plan and status
     """
-    try:
-        logger.info(f"Generating enhanced learning plan for user {user_id}: {prompt[:100]}...")
-        
-        # Prepare enhanced context
-        enhanced_prompt = f"user_id={user_id}, prompt={prompt}"
-        if context:
-            enhanced_prompt += f", context={json.dumps(context)}"
-        
-        # Run the enhanced leader agent to generate the plan
-        start_time = datetime.utcnow()
+    return _run(generate_learning_plan_async(user_id, prompt, context))
+
+def _iso_timestamp(timestamp_ns: int) -> str:
+    """
+    Format a time.time_ns() timestamp as an ISO 8601 UTC string.
+    
+    Args:
+        timestamp_ns: Nanoseconds since the epoch
         
-        response = leader.run(
-            enhanced_prompt,
-            stream=False
-        )
+    Returns:
+        ISO 8601 formatted timestamp
+    """
+    return datetime.fromtimestamp(timestamp_ns / 1e9, tz=timezone.utc).isoformat()
+
+def _parse_lesson_plan(response: Any) -> LessonPlan:
+    """
+    Parse the lesson plan out of a team response.
+    
+    Args:
+        response: The response from the content generation team or leader
         
-        processing_time = (datetime.utcnow() - start_time).total_seconds()
+    Returns:
+        The validated LessonPlan
         
-        logger.info(f"Successfully generated learning plan for user {user_id} in {processing_time:.2f}s")
+    Raises:
+        ValueError: If the response does not contain a valid lesson plan
+    """
+    content = getattr(response, "content", None)
+    if isinstance(content, LessonPlan):
+        return content
+    
+    try:
+        return parse_json(content)
+    except Exception as e:
+        raise ValueError(f"Response did not contain a valid lesson plan: {e}") from e
+
+def _lesson_plan_record(lesson_plan: LessonPlan) -> Dict[str, Any]:
+    """
+    Convert a LessonPlan into the dictionary shape expected by write_lesson_plan.
+    
+    Args:
+        lesson_plan: The validated lesson plan
         
-        return {
-            "success": True,
-            "user_id": user_id,
-            "prompt": prompt,
-            "response": response,
-            "context": context,
-            "processing_time": processing_time,
-            "timestamp": datetime.utcnow().isoformat(),
-            "quality_score": calculate_quality_score(response),
-            "estimated_completion_time": estimate_completion_time(response)
-        }
+    Returns:
+        Dictionary with the plan fields and its lessons
+    """
+    record = lesson_plan.model_dump(mode="json")
+    record["lessons"] = [lesson.model_dump(mode="json") for lesson in lesson_plan.lessons]
+    return record
+
+async def research_lessons(lesson_plan: LessonPlan, max_concurrency: int = RESEARCH_CONCURRENCY) -> None:
+    """
+    Search for external resources for every lesson concurrently and attach them.
+    
+    Lessons keep their generated resources when the search returns no links.
+    
+    Args:
+        lesson_plan: The lesson plan whose lessons should be researched
+        max_concurrency: Maximum number of searches running at the same time
+    """
+    responses = await _gather_bounded(
+        [
+            _arun(get_research_agent(), f"Find sources for the lesson: {lesson.title}")
+            for lesson in lesson_plan.lessons
+        ],
+        max_concurrency
+    )
+    
+    for lesson, response in zip(lesson_plan.lessons, responses):
+        content = str(getattr(response, "content", "") or "")
+        urls = list(dict.fromkeys(url.rstrip(".,;:") for url in URL_PATTERN.findall(content)))
+        if urls:
+            lesson.external_resources = urls[:config.MAX_EXTERNAL_RESOURCES_PER_LESSON]
+
+def classify_prompt(prompt: str) -> str:
+    """
+    Decide how much of the generation pipeline a prompt needs.
+    
+    Args:
+        prompt: The learning prompt or question
         
-    except Exception as e:
-        logger.error(f"Failed to generate learning plan for user {user_id}: {e}", exc_info=True)
-        return {
-            "success": False,
-            "user_id": user_id,
-            "prompt": prompt,
-            "error": str(e),
-            "error_type": type(e).__name__,
-            "timestamp": datetime.utcnow().isoformat(),
-            "retry_recommended": should_retry(e)
-        }
+    Returns:
+        "question" for direct questions, answered by the content generator alone;
+        "ambiguous" for very short prompts, which need the leader to work out the
+        user's intent; "learning" for explicit learning requests
+    """
+    if prompt.rstrip().endswith("?"):
+        return "question"
+    if len(prompt.split()) < 5:
+        return "ambiguous"
+    return "learning"
 
-def calculate_quality_score(response: Any) -> float:
+def _content_length(response: Any) -> int:
+    """
+    Length of the response content as text, or 0 when there is no content.
+    """
+    content = getattr(response, 'content', None)
+    return len(str(content)) if content else 0
+
+def calculate_quality_score(response: Any, content_length: int) -> float:
     """
     Calculate a quality score for the generated learning plan.
     
     Args:
         response: The response from the AI agent
+        content_length: Length of the response content, from _content_length
         
     Returns:
         Quality score between 0 and 1
@@ -370,12 +538,10 @@ def calculate_quality_score(response: Any) -> float:
         # Simple quality scoring based on response characteristics
         score = 0.5  # Base score
         
-        if hasattr(response, 'content') and response.content:
-            content_length = len(str(response.content))
-            if content_length > 1000:
-                score += 0.2
-            if content_length > 2000:
-                score += 0.1
+        if content_length > 1000:
+            score += 0.2
+        if content_length > 2000:
+            score += 0.1
                 
         if hasattr(response, 'structured_outputs') and response.structured_outputs:
             score += 0.2
@@ -386,12 +552,12 @@ def calculate_quality_score(response: Any) -> float:
         logger.warning(f"Failed to calculate quality score: {e}")
         return 0.5
 
-def estimate_completion_time(response: Any) -> int:
+def estimate_completion_time(content_length: int) -> int:
     """
     Estimate the time to complete the learning plan.
     
     Args:
-        response: The response from the AI agent
+        content_length: Length of the response content, from _content_length
         
     Returns:
         Estimated completion time in minutes
@@ -400,12 +566,10 @@ def estimate_completion_time(response: Any) -> int:
         # Simple estimation based on content complexity
         base_time = 30  # Base 30 minutes
         
-        if hasattr(response, 'content') and response.content:
-            content_length = len(str(response.content))
-            if content_length > 2000:
-                base_time += 30
-            if content_length > 5000:
-                base_time += 60
+        if content_length > 2000:
+            base_time += 30
+        if content_length > 5000:
+            base_time += 60
                 
         return base_time
         
@@ -423,20 +587,180 @@ def should_retry(error: Exception) -> bool:
     Returns:
         True if retry is recommended, False otherwise
     """
-    # Retry on transient errors
-    retryable_errors = [
-        'ConnectionError',
-        'TimeoutError',
-        'RateLimitError',
-        'ServiceUnavailableError'
-    ]
+    return type(error).__name__ in _RETRYABLE_ERRORS
+
+def _enhanced_prompt(user_id: str, prompt: str, context: Optional[Dict[str, Any]]) -> str:
+    """
+    Combine the user_id, prompt and optional context into a single instruction.
     
-    error_name = type(error).__name__
-    return error_name in retryable_errors
+    Args:
+        user_id: The user's unique identifier
+        prompt: The learning prompt or question
+        context: Additional context for personalization
+        
+    Returns:
+        The combined prompt string
+    """
+    enhanced_prompt = f"user_id={user_id}, prompt={prompt}"
+    if context:
+        enhanced_prompt += f", context={orjson.dumps(context).decode()}"
+    return enhanced_prompt
+
+def _plan_request(user_id: str, prompt: str, enhanced_prompt: str) -> str:
+    """
+    Build the task message for the content generation team.
+    
+    Args:
+        user_id: The user's unique identifier
+        prompt: The learning prompt or question
+        enhanced_prompt: The prompt combined with user_id and context
+        
+    Returns:
+        Task message in the format the team instructions expect
+    """
+    return (
+        f"source_prompt: {prompt}\n"
+        f"user_id: {user_id}\n"
+        f"refined instruction: Curate a learning plan for {enhanced_prompt}"
+    )
+
+async def _complete_learning_plan(
+    user_id: str,
+    response: Any,
+    context: Optional[Dict[str, Any]] = None
+) -> Tuple[LessonPlan, Dict[str, Any]]:
+    """
+    Run the stages that follow content generation concurrently, then store the plan.
+    
+    The knowledge graph, learning analytics and adaptive learning agents only need the
+    generated plan, so they run alongside each other and the per-lesson research, and
+    the plan is written to the database once, with its researched resources.
+    
+    Args:
+        user_id: The user's unique identifier
+        response: The response from the content generation team
+        context: Additional context for personalization
+        
+    Returns:
+        Tuple of the parsed lesson plan and the responses of the graph,
+        analytics and adaptive stages keyed by result field
+        
+    Raises:
+        ValueError: If the response does not contain a valid lesson plan, in
+        which case none of the stages are run
+    """
+    lesson_plan = _parse_lesson_plan(response)
+    plan_details = (
+        f"plan_id: {lesson_plan.plan_id}\n"
+        f"lesson_plan: {orjson.dumps(_lesson_plan_record(lesson_plan)).decode()}"
+    )
+    
+    stages = asyncio.gather(
+        _arun(
+            get_knowledge_graph_agent(),
+            f"user_id: {user_id}\n"
+            f"{plan_details}\n"
+            f"refined instruction: Generate a knowledge graph of the lesson plan"
+        ),
+        _arun(
+            get_learning_analytics_agent(),
+            f"user_id: {user_id}\n"
+            f"{plan_details}\n"
+            f"refined instruction: Recommend learning strategies for this lesson plan"
+        ),
+        _arun(
+            get_adaptive_learning_agent(),
+            f"user_id: {user_id}\n"
+            f"context: {orjson.dumps(context or {}).decode()}\n"
+            f"{plan_details}\n"
+            f"refined instruction: Personalize the pacing and difficulty of this lesson plan"
+        ),
+    )
+    (graph_response, analytics_response, adaptive_response), _ = await asyncio.gather(
+        stages, research_lessons(lesson_plan)
+    )
+    await _store_lesson_plan(user_id, lesson_plan)
+    
+    return lesson_plan, {
+        "graph_response": graph_response,
+        "analytics_response": analytics_response,
+        "adaptive_response": adaptive_response,
+    }
+
+async def _store_lesson_plan(user_id: str, lesson_plan: LessonPlan) -> None:
+    """
+    Write a validated lesson plan to the database without blocking the event loop.
+    
+    Args:
+        user_id: The user's unique identifier
+        lesson_plan: The validated lesson plan
+    """
+    from data.utils import write_lesson_plan
+    
+    await asyncio.to_thread(write_lesson_plan, user_id, _lesson_plan_record(lesson_plan))
+
+def _plan_result(
+    user_id: str,
+    prompt: str,
+    context: Optional[Dict[str, Any]],
+    started_ns: int,
+    response: Any,
+    lesson_plan: LessonPlan,
+    stage_responses: Dict[str, Any]
+) -> Dict[str, Any]:
+    """
+    Build the success payload for a generated learning plan.
+    
+    Returns:
+        Dictionary containing the generated plan and status
+    """
+    processing_time = (time.time_ns() - started_ns) / 1e9
+    content_length = _content_length(response)
+    
+    logger.info(f"Successfully generated learning plan for user {user_id} in {processing_time:.2f}s")
+    
+    return {
+        "success": True,
+        "user_id": user_id,
+        "prompt": prompt,
+        "plan_id": lesson_plan.plan_id,
+        "response": response,
+        **stage_responses,
+        "context": context,
+        "processing_time": processing_time,
+        "timestamp": _iso_timestamp(started_ns),
+        "quality_score": calculate_quality_score(response, content_length),
+        "estimated_completion_time": estimate_completion_time(content_length)
+    }
+
+def _error_result(user_id: str, prompt: str, started_ns: int, error: Exception) -> Dict[str, Any]:
+    """
+    Build the failure payload for a learning plan request.
+    
+    Returns:
+        Dictionary describing the error and whether a retry is recommended
+    """
+    logger.error(f"Failed to generate learning plan for user {user_id}: {error}", exc_info=True)
+    return {
+        "success": False,
+        "user_id": user_id,
+        "prompt": prompt,
+        "error": str(error),
+        "error_type": type(error).__name__,
+        "timestamp": _iso_timestamp(started_ns),
+        "retry_recommended": should_retry(error)
+    }
 
 async def generate_learning_plan_async(user_id: str, prompt: str, context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
     """
-    Asynchronous version of generate_learning_plan for better performance.
+    Generate a learning plan and its knowledge graph for a user.
+    
+    The content generation team is invoked directly rather than through the
+    Claude-coordinated leader, which saves a full coordinator round trip. Only prompts
+    classified as ambiguous are routed through the leader, and direct questions are
+    answered by the content generator alone. The plan is validated and written in
+    Python rather than by a writer agent, and the knowledge graph, analytics and
+    adaptive stages run concurrently with the per-lesson research.
     
     Args:
         user_id: The user's unique identifier
@@ -446,64 +770,275 @@ async def generate_learning_plan_async(user_id: str, prompt: str, context: Optio
     Returns:
         Dictionary containing the generated plan and status
     """
+    started_ns = time.time_ns()
+    cache_token = start_request_cache()
     try:
-        logger.info(f"Starting async learning plan generation for user {user_id}")
-        
-        # Run the generation in a thread pool to avoid blocking
-        loop = asyncio.get_event_loop()
-        result = await loop.run_in_executor(
-            None, 
-            generate_learning_plan, 
-            user_id, 
-            prompt, 
-            context
-        )
+        logger.info(f"Generating enhanced learning plan for user {user_id}: {prompt[:100]}...")
         
-        return result
+        enhanced_prompt = _enhanced_prompt(user_id, prompt, context)
+        prompt_type = classify_prompt(prompt)
+        
+        if prompt_type == "question":
+            # A direct question only needs an answer, not the graph or personalization stages
+            response = await _arun(get_content_generator_agent(), _plan_request(user_id, prompt, enhanced_prompt))
+            lesson_plan = _parse_lesson_plan(response)
+            await _store_lesson_plan(user_id, lesson_plan)
+            stage_responses = dict.fromkeys(("graph_response", "analytics_response", "adaptive_response"))
+            return _plan_result(user_id, prompt, context, started_ns, response, lesson_plan, stage_responses)
+        
+        if prompt_type == "ambiguous":
+            # Let the Claude coordinator work out what the user is asking for
+            response = await _arun(get_leader(), enhanced_prompt)
+        else:
+            response = await _arun(get_content_generation_agent(), _plan_request(user_id, prompt, enhanced_prompt))
+        
+        lesson_plan, stage_responses = await _complete_learning_plan(user_id, response, context)
+        
+        return _plan_result(user_id, prompt, context, started_ns, response, lesson_plan, stage_responses)
         
     except Exception as e:
-        logger.error(f"Async learning plan generation failed for user {user_id}: {e}")
-        return {
-            "success": False,
-            "user_id": user_id,
-            "prompt": prompt,
-            "error": str(e),
-            "timestamp": datetime.utcnow().isoformat()
-        }
+        return _error_result(user_id, prompt, started_ns, e)
+    finally:
+        end_request_cache(cache_token)
 
-def batch_generate_plans(user_prompts: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+async def stream_learning_plan(
+    user_id: str,
+    prompt: str,
+    context: Optional[Dict[str, Any]] = None
+) -> AsyncIterator[Dict[str, Any]]:
     """
-    Generate learning plans for multiple users in batch.
+    Generate a learning plan, yielding the content team's output as it is produced.
+    
+    Yields {"event": "content", ...} for every streamed chunk, followed by a single
+    {"event": "complete", ...} carrying the same payload as generate_learning_plan_async,
+    or {"event": "error", ...} if generation fails.
+    
+    Generation runs in its own task, so its request cache and OpenAI reservation never
+    span a yield to the consumer. Closing the generator early cancels generation.
+    
+    Args:
+        user_id: The user's unique identifier
+        prompt: The learning prompt or question
+        context: Additional context for personalization
+        
+    Yields:
+        Event dictionaries suitable for forwarding over SSE or a WebSocket
+    """
+    events: "asyncio.Queue[Optional[Dict[str, Any]]]" = asyncio.Queue()
+    producer = asyncio.create_task(_produce_plan_events(user_id, prompt, context, events))
+    try:
+        while (event := await events.get()) is not None:
+            yield event
+    finally:
+        producer.cancel()
+
+async def _produce_plan_events(
+    user_id: str,
+    prompt: str,
+    context: Optional[Dict[str, Any]],
+    events: "asyncio.Queue[Optional[Dict[str, Any]]]"
+) -> None:
+    """
+    Run the generation behind stream_learning_plan, putting its events on events.
+    
+    None is put on the queue once generation has finished, successfully or not.
+    """
+    started_ns = time.time_ns()
+    cache_token = start_request_cache()
+    try:
+        logger.info(f"Streaming learning plan for user {user_id}: {prompt[:100]}...")
+        
+        chunks: List[str] = []
+        lesson_plan: Optional[LessonPlan] = None
+        request = _plan_request(user_id, prompt, _enhanced_prompt(user_id, prompt, context))
+        async with get_openai_limiter().reserve(_estimate_tokens(request)):
+            stream = await get_content_generation_agent().arun(request, stream=True)
+            async for chunk in stream:
+                content = getattr(chunk, "content", None)
+                if isinstance(content, LessonPlan):
+                    # Structured output arrives whole rather than as text deltas
+                    lesson_plan = content
+                elif content:
+                    chunks.append(str(content))
+                if content:
+                    events.put_nowait({"event": "content", "user_id": user_id, "content": content})
+        
+        response = SimpleNamespace(content=lesson_plan or "".join(chunks))
+        lesson_plan, stage_responses = await _complete_learning_plan(user_id, response, context)
+        events.put_nowait({
+            "event": "complete",
+            **_plan_result(user_id, prompt, context, started_ns, response, lesson_plan, stage_responses)
+        })
+        
+    except Exception as e:
+        events.put_nowait({"event": "error", **_error_result(user_id, prompt, started_ns, e)})
+    finally:
+        end_request_cache(cache_token)
+        events.put_nowait(None)
+
+async def batch_generate_plans_async(
+    user_prompts: List[Dict[str, Any]],
+    max_concurrency: int = 10
+) -> List[Dict[str, Any]]:
+    """
+    Generate learning plans for multiple users concurrently.
+    
+    A failing request does not affect the rest of the batch; its exception is
+    reported in place as an error result.
     
     Args:
         user_prompts: List of dictionaries containing user_id and prompt
+        max_concurrency: Maximum number of plans generated at the same time
         
     Returns:
-        List of generated plans
+        List of generated plans, in the same order as user_prompts
     """
-    results = []
-    
-    for user_prompt in user_prompts:
-        try:
-            result = generate_learning_plan(
+    outcomes = await _gather_bounded(
+        [
+            generate_learning_plan_async(
                 user_prompt['user_id'],
                 user_prompt['prompt'],
                 user_prompt.get('context')
             )
-            results.append(result)
-        except Exception as e:
-            logger.error(f"Batch generation failed for user {user_prompt.get('user_id')}: {e}")
-            results.append({
+            for user_prompt in user_prompts
+        ],
+        max_concurrency,
+        return_exceptions=True
+    )
+    
+    results = []
+    for user_prompt, outcome in zip(user_prompts, outcomes):
+        if isinstance(outcome, Exception):
+            logger.error(f"Batch generation failed for user {user_prompt.get('user_id')}: {outcome}")
+            outcome = {
                 "success": False,
                 "user_id": user_prompt.get('user_id'),
                 "prompt": user_prompt.get('prompt'),
-                "error": str(e),
-                "timestamp": datetime.utcnow().isoformat()
-            })
+                "error": str(outcome),
+                "timestamp": datetime.now(timezone.utc).isoformat()
+            }
+        results.append(outcome)
     
     return results
 
-if __name__ == "__main__":
+def batch_generate_plans(user_prompts: List[Dict[str, Any]], max_concurrency: int = 10) -> List[Dict[str, Any]]:
+    """
+    Synchronous wrapper around batch_generate_plans_async.
+    
+    Args:
+        user_prompts: List of dictionaries containing user_id and prompt
+        max_concurrency: Maximum number of plans generated at the same time
+        
+    Returns:
+        List of generated plans
+    """
+    return _run(batch_generate_plans_async(user_prompts, max_concurrency))
+
+async def _gather_bounded(
+    coroutines: List[Awaitable[Any]],
+    max_concurrency: int,
+    return_exceptions: bool = False
+) -> List[Any]:
+    """
+    Await coroutines concurrently with at most max_concurrency in flight.
+    
+    Args:
+        coroutines: The coroutines to run
+        max_concurrency: Upper bound on concurrently running coroutines
+        return_exceptions: Return exceptions in place of results instead of raising
+        
+    Returns:
+        Results in the same order as the given coroutines
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+    
+    async def run(coroutine: Awaitable[Any]) -> Any:
+        async with semaphore:
+            return await coroutine
+    
+    return await asyncio.gather(
+        *(run(coroutine) for coroutine in coroutines),
+        return_exceptions=return_exceptions
+    )
+
+async def generate_learning_plans_batch_async(
+    items: List[Tuple[str, str]],
+    max_concurrency: int = 10
+) -> List[Dict[str, Any]]:
+    """
+    Generate learning plans for many (user_id, prompt) pairs concurrently.
+    
+    Args:
+        items: List of (user_id, prompt) tuples
+        max_concurrency: Maximum number of plans generated at the same time
+        
+    Returns:
+        List of generation results, in the same order as items
+    """
+    logger.info(f"Generating {len(items)} learning plans with concurrency {max_concurrency}")
+    return await _gather_bounded(
+        [generate_learning_plan_async(user_id, prompt) for user_id, prompt in items],
+        max_concurrency
+    )
+
+def generate_learning_plans_batch(
+    items: List[Tuple[str, str]],
+    max_concurrency: int = 10
+) -> List[Dict[str, Any]]:
+    """
+    Synchronous wrapper around generate_learning_plans_batch_async.
+    
+    Args:
+        items: List of (user_id, prompt) tuples
+        max_concurrency: Maximum number of plans generated at the same time
+        
+    Returns:
+        List of generation results, in the same order as items
+    """
+    return _run(generate_learning_plans_batch_async(items, max_concurrency))
+
+# Lesson plan returned by every agent when DRY_RUN=1
+SAMPLE_PLAN = json.dumps({
+    "plan_id": "sample_plan",
+    "title": "Machine Learning Fundamentals",
+    "description": "A short introduction to supervised learning",
+    "source_prompt": "I want to learn about machine learning fundamentals with practical applications",
+    "lessons": [{
+        "lesson_id": "lesson_1",
+        "title": "What is Machine Learning?",
+        "objectives": ["Define machine learning"],
+        "content": "Machine learning builds models from data.",
+        "external_resources": ["https://en.wikipedia.org/wiki/Machine_learning"],
+        "order": 0
+    }]
+})
+
+
+def _use_dry_run_agents() -> None:
+    """Replace the agents and Firestore writes with stubs so the test makes no external calls."""
+    global get_leader, get_content_generator_agent, get_content_generation_agent
+    global get_knowledge_graph_agent, get_research_agent
+    global get_learning_analytics_agent, get_adaptive_learning_agent
+    global _store_lesson_plan
+
+    async def arun(*args, **kwargs):
+        return SimpleNamespace(content=SAMPLE_PLAN)
+
+    async def store_lesson_plan(user_id: str, lesson_plan: LessonPlan) -> None:
+        logger.info(f"Dry run: skipping write of lesson plan {lesson_plan.plan_id}")
+
+    dry_run_agent = SimpleNamespace(arun=arun)
+    get_leader = get_content_generator_agent = get_content_generation_agent = lambda: dry_run_agent
+    get_knowledge_graph_agent = get_research_agent = lambda: dry_run_agent
+    get_learning_analytics_agent = get_adaptive_learning_agent = lambda: dry_run_agent
+    _store_lesson_plan = store_lesson_plan
+
+
+# Running the module directly calls the paid model APIs, so it only does so on request
+if __name__ == "__main__" and os.getenv("RUN_INTEGRATION_TEST") == "1":
+    if os.getenv("DRY_RUN") == "1":
+        _use_dry_run_agents()
+
     # Test the enhanced system
     try:
         logger.info("Testing enhanced Know-Flow content generation system...")
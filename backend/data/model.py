@@ -2,7 +2,8 @@ from datetime import datetime
 from typing import List, Dict, Any, Optional
 from enum import Enum
 import json
-from pydantic import BaseModel, Field, ConfigDict, field_validator, model_validator
+from pydantic import BaseModel, Field, ConfigDict, ValidationError, field_validator, model_validator
+from pydantic_core import from_json
 from pydantic.alias_generators import to_camel
 
 
@@ -172,6 +173,19 @@ class LessonPlan(FirestoreModel):
     #     }
 
 
+def parse_json(model_output):
+    try:
+        # Parse and validate complete JSON in a single pass, without building
+        # an intermediate dict
+        return LessonPlan.model_validate_json(model_output)
+    except ValidationError as e:
+        if not any(error["type"] == "json_invalid" for error in e.errors()):
+            raise
+    # Truncated model output still parses leniently
+    lesson_plan = LessonPlan.model_validate(from_json(model_output, allow_partial=True))
+    return lesson_plan
+
+
 class UserFeedback(FirestoreModel):
     accuracy_rating: Optional[int] = Field(
         None, ge=1, le=5, description="Rating from 1-5"
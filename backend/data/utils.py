@@ -1,31 +1,25 @@
-import os
 import firebase_admin
 from firebase_admin import credentials
 from firebase_admin import firestore
-from pydantic_core import from_json
 import logging
 
 from data.model import (
-    KnowledgeGraph,
-    LessonPlan,
     UserArtifact,
     UserProfile,
-    Lesson,
+    parse_json,
 )
 
-from dotenv import load_dotenv
+from config import config
+from _request_cache import request_cached
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Load environment variables
-load_dotenv()
-
 # Initialize Firebase only if not already initialized
 if not firebase_admin._apps:
     # Use environment variable for Firebase credentials path
-    fbpath = os.getenv("FIRESTORE_PATH")
+    fbpath = config.FIRESTORE_PATH
     if not fbpath:
         raise ValueError("FIRESTORE_PATH environment variable not set")
     
@@ -56,15 +50,12 @@ def write_lessons_from_artifact(user_artifact: UserArtifact):
         write_lesson_plan(user_artifact.user_id, lesson_plan)
 
 
-def parse_json(model_output):
-    lesson_plan = LessonPlan.model_validate(from_json(model_output, allow_partial=True))
-    return lesson_plan
-
-
+@request_cached
 def fetch_user_id():
     return "aturing"
 
 
+@request_cached
 def get_lesson_plan(userId, planId):
     userdb = db.collection("users").document(userId)
     lessons_ref = userdb.collection("lessonPlans")
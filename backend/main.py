@@ -1,23 +1,40 @@
-from fastapi import FastAPI, HTTPException, Depends, Request, status
+from fastapi import BackgroundTasks, FastAPI, HTTPException, Depends, Query, Request, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 from fastapi.exceptions import RequestValidationError
+from starlette.routing import Match
 from pydantic import BaseModel, Field, ValidationError
-from typing import List, Dict, Any, Optional
-import os
-import json
-from datetime import datetime, timedelta
+from typing import List, Dict, Any, Optional, Tuple
+from datetime import datetime, timedelta, timezone
 import asyncio
+import base64
+import hashlib
+import httpx
 from openai import AsyncOpenAI
 import firebase_admin
-from firebase_admin import credentials, firestore, auth
-from dotenv import load_dotenv
+from firebase_admin import credentials, firestore_async, auth
+from google.cloud.firestore import SERVER_TIMESTAMP, AsyncClient, AsyncDocumentReference
+from google.cloud.firestore_v1.field_path import FieldPath
 import uuid
 import logging
+import math
+import orjson
+import queue
 import time
+from collections import OrderedDict
 from contextlib import asynccontextmanager
+from functools import cache, lru_cache, partial
+from logging.handlers import QueueHandler, QueueListener
+
+from prometheus_client import Gauge, make_asgi_app
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from config import config
+from plan_queue import PlanQueue
+from rate_limit import LocalTokenBucket, RedisTokenBucket, RouteLimit, rate_limit
 
 # Configure logging
 logging.basicConfig(
@@ -26,56 +43,165 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Load environment variables first
-load_dotenv()
+class _DeferredQueueHandler(QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread"""
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The queue is in-process, so the record does not need to be made picklable
+        return record
+
+def _start_log_listener() -> QueueListener:
+    """Move the root handlers behind a queue served by a listener thread.
+    
+    Log calls then only enqueue the record, keeping stream writes off the event loop.
+    Called from lifespan so every worker process starts its own thread: with
+    gunicorn's preload_app, a thread started at import stays in the master and the
+    forked workers' records would never be written.
+    """
+    root_logger = logging.getLogger()
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    listener = QueueListener(log_queue, *root_logger.handlers, respect_handler_level=True)
+    root_logger.handlers = [_DeferredQueueHandler(log_queue)]
+    listener.start()
+    return listener
+
+def _stop_log_listener(listener: QueueListener) -> None:
+    """Write out queued records and give the root logger its handlers back"""
+    listener.stop()
+    logging.getLogger().handlers = list(listener.handlers)
 
 # Verify required environment variables
-required_env_vars = [
-    'FIREBASE_PROJECT_ID',
-    'FIREBASE_CLIENT_EMAIL', 
-    'FIREBASE_PRIVATE_KEY',
-    'OPENAI_API_KEY'
-]
-
-missing_vars = [key for key in required_env_vars if not os.getenv(key)]
-if missing_vars:
-    logger.error(f"Missing environment variables: {missing_vars}")
+try:
+    config.validate()
+except ValueError as e:
+    logger.error(str(e))
     exit(1)
 
-# Initialize Firebase Admin SDK
-service_account_info = {
-    "type": "service_account",
-    "project_id": os.getenv('FIREBASE_PROJECT_ID'),
-    "client_email": os.getenv('FIREBASE_CLIENT_EMAIL'),
-    "private_key": os.getenv('FIREBASE_PRIVATE_KEY').replace('\\n', '\n'),
-    "auth_uri": "https://accounts.google.com/o/oauth2/auth",
-    "token_uri": "https://oauth2.googleapis.com/token",
-    "auth_provider_x509_cert_url": "https://www.googleapis.com/oauth2/v1/certs",
-    "client_x509_cert_url": f"https://www.googleapis.com/robot/v1/metadata/x509/{os.getenv('FIREBASE_CLIENT_EMAIL')}"
-}
+@cache
+def _get_credentials() -> credentials.Certificate:
+    """Firebase service account credentials, parsed once from the config."""
+    return credentials.Certificate(config.get_firebase_config())
 
+# Initialize Firebase Admin SDK
 if not firebase_admin._apps:
     try:
-        cred = credentials.Certificate(service_account_info)
-        firebase_admin.initialize_app(cred)
+        firebase_admin.initialize_app(_get_credentials())
         logger.info("Firebase initialized successfully")
     except Exception as e:
         logger.error(f"Failed to initialize Firebase: {e}")
         exit(1)
 
-db = firestore.client()
+# Native asyncio client; its gRPC channel is opened lazily on the first request
+db = firestore_async.client()
 
-# Rate limiting storage
-rate_limit_storage = {}
+# Per-process rate limiting, used when Redis is not configured or unavailable
+local_rate_limiter = LocalTokenBucket(
+    capacity=config.RATE_LIMIT_REQUESTS,
+    window_seconds=config.RATE_LIMIT_WINDOW_SECONDS,
+    max_clients=config.RATE_LIMIT_MAX_CLIENTS
+)
+
+# Per-process buckets for routes with their own rate_limit, built in lifespan
+local_route_limiters: Dict[RouteLimit, LocalTokenBucket] = {}
+
+# Read at scrape time, so tracking saturation costs nothing per request
+RATE_LIMIT_CLIENTS = Gauge(
+    "knowflow_rate_limit_clients",
+    "Clients tracked by this process's fallback rate limiters"
+)
+RATE_LIMIT_CLIENTS.set_function(
+    lambda: len(local_rate_limiter) + sum(len(limiter) for limiter in local_route_limiters.values())
+)
+
+# Learning plans are generated in the background, a batch at a time
+plan_queue = PlanQueue(
+    db,
+    batch_size=config.PLAN_BATCH_SIZE,
+    max_wait_seconds=config.PLAN_BATCH_MAX_WAIT_SECONDS,
+    processing_timeout_seconds=config.PLAN_PROCESSING_TIMEOUT_SECONDS
+)
 
 # Startup and shutdown events
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
-    logger.info("Starting Know-Flow API...")
-    yield
-    # Shutdown
-    logger.info("Shutting down Know-Flow API...")
+    log_listener = _start_log_listener()
+    try:
+        logger.info("Starting Know-Flow API...")
+        redis_client = None
+        app.state.rate_limiter = None
+        if config.REDIS_URL:
+            # Short timeouts so an unreachable Redis degrades to the per-process limit quickly
+            redis_client = Redis.from_url(config.REDIS_URL, socket_timeout=0.25, socket_connect_timeout=0.25)
+            app.state.rate_limiter = RedisTokenBucket(
+                redis_client,
+                capacity=config.RATE_LIMIT_REQUESTS,
+                window_seconds=config.RATE_LIMIT_WINDOW_SECONDS
+            )
+        
+        # Routes declared with rate_limit, matched by rate_limit_middleware in routing order.
+        # Routes with the same limit share their buckets.
+        app.state.route_limits = [
+            (route, route.endpoint.__rate_limit__)
+            for route in app.routes
+            if hasattr(getattr(route, "endpoint", None), "__rate_limit__")
+        ]
+        app.state.route_rate_limiters = {}
+        for _, limit in app.state.route_limits:
+            if limit.capacity is None:
+                continue
+            if limit not in local_route_limiters:
+                local_route_limiters[limit] = LocalTokenBucket(
+                    capacity=limit.capacity,
+                    window_seconds=limit.window_seconds,
+                    max_clients=config.RATE_LIMIT_MAX_CLIENTS
+                )
+            if redis_client is not None and limit not in app.state.route_rate_limiters:
+                app.state.route_rate_limiters[limit] = RedisTokenBucket(
+                    redis_client,
+                    capacity=limit.capacity,
+                    window_seconds=limit.window_seconds
+                )
+        
+        # One pooled OpenAI client for the process, so probes reuse warm TLS connections
+        app.state.openai = AsyncOpenAI(
+            api_key=config.OPENAI_API_KEY,
+            timeout=httpx.Timeout(10.0, connect=2.0),
+            http_client=httpx.AsyncClient(limits=httpx.Limits(max_keepalive_connections=50))
+        )
+        
+        # The plan queue blocks on Redis list commands, so it gets a client without the
+        # rate limiter's short socket timeout
+        queue_redis_client = Redis.from_url(config.REDIS_URL) if config.REDIS_URL else None
+        await plan_queue.start(queue_redis_client)
+        yield
+        # Shutdown
+        logger.info("Shutting down Know-Flow API...")
+        await plan_queue.stop()
+        await app.state.openai.close()
+        if redis_client is not None:
+            await redis_client.aclose()
+        if queue_redis_client is not None:
+            await queue_redis_client.aclose()
+    finally:
+        _stop_log_listener(log_listener)
+
+def _orjson_default(value: Any) -> Any:
+    # Firestore returns Timestamp fields as DatetimeWithNanoseconds, a datetime
+    # subclass that orjson does not serialize natively
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+class FirestoreJSONResponse(ORJSONResponse):
+    """ORJSONResponse that also serializes Firestore document values"""
+    
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(
+            content,
+            default=_orjson_default,
+            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        )
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -84,16 +210,17 @@ app = FastAPI(
     description="AI-powered learning management system API with enhanced features",
     docs_url="/docs",
     redoc_url="/redoc",
+    default_response_class=FirestoreJSONResponse,
     lifespan=lifespan
 )
 
 # Enhanced middleware
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],  # Configure appropriately for production
+    allow_origins=list(config.ALLOWED_ORIGINS),
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET", "POST"],
+    allow_headers=["Authorization", "Content-Type"],
 )
 
 app.add_middleware(
@@ -104,6 +231,9 @@ app.add_middleware(
 # Security
 security = HTTPBearer()
 
+# Timezone-aware current time; a partial avoids a Python frame per call
+_utcnow = partial(datetime.now, timezone.utc)
+
 # Enhanced Pydantic models
 class UserPromptRequest(BaseModel):
     userId: str = Field(..., min_length=1, max_length=100, description="User identifier")
@@ -116,7 +246,7 @@ class UserPromptGetResponse(BaseModel):
     lessons: List[Dict[str, Any]]
     success: bool = True
     message: str = "Success"
-    timestamp: str = Field(default_factory=lambda: datetime.utcnow().isoformat())
+    timestamp: datetime = Field(default_factory=_utcnow)
 
 class UserPromptPostResponse(BaseModel):
     success: bool
@@ -131,75 +261,128 @@ class ErrorResponse(BaseModel):
     success: bool = False
     error: str
     details: Optional[str] = None
-    timestamp: str = Field(default_factory=lambda: datetime.utcnow().isoformat())
+    timestamp: datetime = Field(default_factory=_utcnow)
     requestId: Optional[str] = None
 
 class HealthResponse(BaseModel):
     status: str
     database: str
     ai_service: str
-    timestamp: str
+    timestamp: datetime
     version: str
     uptime: float
 
 # Enhanced error handling
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
         content=ErrorResponse(
             error="Validation Error",
             details=str(exc),
-            requestId=str(uuid.uuid4())
-        ).dict()
+            requestId=uuid.uuid4().hex
+        ).model_dump()
     )
 
 @app.exception_handler(Exception)
 async def general_exception_handler(request: Request, exc: Exception):
-    request_id = str(uuid.uuid4())
+    request_id = uuid.uuid4().hex
     logger.error(f"Unhandled exception {request_id}: {exc}", exc_info=True)
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
         content=ErrorResponse(
             error="Internal Server Error",
             details="An unexpected error occurred",
             requestId=request_id
-        ).dict()
+        ).model_dump()
+    )
+
+# Constant fields of the 429 body, in ErrorResponse field order; rejected requests
+# skip building and validating an ErrorResponse
+_RATE_LIMIT_BODY: Dict[str, Any] = {
+    "success": False,
+    "error": "Rate limit exceeded",
+    "details": "Too many requests. Please try again later."
+}
+
+def _rate_limited_response(retry_after: Optional[float] = None) -> ORJSONResponse:
+    """429 response for a client that has used up its requests"""
+    return ORJSONResponse(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        content={**_RATE_LIMIT_BODY, "timestamp": _utcnow(), "requestId": None},
+        headers={"Retry-After": str(math.ceil(retry_after))} if retry_after else None
     )
 
 # Rate limiting middleware
 async def rate_limit_middleware(request: Request, call_next):
-    client_ip = request.client.host
-    current_time = time.time()
+    client_id = request.client.host
+    limiter = request.app.state.rate_limiter
+    fallback_limiter = local_rate_limiter
     
-    # Clean old entries
-    rate_limit_storage = {k: v for k, v in rate_limit_storage.items() 
-                         if current_time - v['timestamp'] < 60}
+    # Routes with their own limit use a bucket per client and route path
+    for route, limit in request.app.state.route_limits:
+        if route.matches(request.scope)[0] is Match.FULL:
+            if limit.capacity is None:
+                return await call_next(request)
+            client_id = f"{client_id}:{route.path}"
+            limiter = request.app.state.route_rate_limiters.get(limit)
+            fallback_limiter = local_route_limiters[limit]
+            break
     
-    if client_ip in rate_limit_storage:
-        if rate_limit_storage[client_ip]['count'] >= 100:  # 100 requests per minute
-            return JSONResponse(
-                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-                content=ErrorResponse(
-                    error="Rate limit exceeded",
-                    details="Too many requests. Please try again later."
-                ).dict()
-            )
-        rate_limit_storage[client_ip]['count'] += 1
-    else:
-        rate_limit_storage[client_ip] = {'count': 1, 'timestamp': current_time}
+    # Shared limit across all workers when Redis is configured
+    if limiter is not None:
+        try:
+            allowed, retry_after = await limiter.allow(client_id)
+        except RedisError as e:
+            logger.warning(f"Redis rate limiter unavailable, using per-process limit: {e}")
+        else:
+            if not allowed:
+                return _rate_limited_response(retry_after)
+            return await call_next(request)
+    
+    allowed, retry_after = fallback_limiter.allow(client_id)
+    if not allowed:
+        return _rate_limited_response(retry_after)
     
     response = await call_next(request)
     return response
 
 app.middleware("http")(rate_limit_middleware)
 
+# Prometheus metrics for this worker process
+app.mount("/metrics", make_asgi_app())
+
+# Verified ID token claims by token hash, least recently used first. Entries expire
+# after TOKEN_CACHE_TTL seconds or at the token's own exp, whichever comes first,
+# which bounds how long a revoked token keeps working.
+TOKEN_CACHE_SIZE = 10000
+TOKEN_CACHE_TTL = 300
+_token_cache: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+
+async def _verify_id_token(token: str) -> Dict[str, Any]:
+    """Verify a Firebase ID token, reusing the claims of recently verified tokens"""
+    key = hashlib.sha256(token.encode()).hexdigest()
+    now = time.time()
+    
+    cached = _token_cache.get(key)
+    if cached is not None:
+        expires_at, claims = cached
+        if now < expires_at:
+            _token_cache.move_to_end(key)
+            return claims
+        del _token_cache[key]
+    
+    # Signature verification is CPU-bound and may fetch Google's public keys
+    claims = await asyncio.to_thread(auth.verify_id_token, token)
+    _token_cache[key] = (min(now + TOKEN_CACHE_TTL, claims.get("exp", now)), claims)
+    if len(_token_cache) > TOKEN_CACHE_SIZE:
+        _token_cache.popitem(last=False)
+    return claims
+
 # Enhanced authentication dependency
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     try:
-        token = credentials.credentials
-        decoded_token = auth.verify_id_token(token)
-        return decoded_token
+        return await _verify_id_token(credentials.credentials)
     except Exception as e:
         logger.error(f"Authentication failed: {e}")
         raise HTTPException(
@@ -208,58 +391,210 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         )
 
 # Dependency for Firebase client
-def get_firestore_client():
+def get_firestore_client() -> AsyncClient:
     return db
 
+@lru_cache(maxsize=10_000)
+def _user_ref(db_client: AsyncClient, user_id: str) -> AsyncDocumentReference:
+    """Reference to a user's document, built once per user; references are immutable"""
+    return db_client.collection("users").document(user_id)
+
+async def _count(query) -> int:
+    """Number of documents matching query, counted server-side without reading them"""
+    result = await query.count().get()
+    return int(result[0][0].value)
+
+async def _aggregate(aggregation_query) -> Dict[str, Any]:
+    """Run a server-side aggregation query and return its results by alias"""
+    result = await aggregation_query.get()
+    return {aggregation.alias: aggregation.value for aggregation in result[0]}
+
 # Enhanced health check endpoint
-@app.get("/", tags=["Health"], response_model=Dict[str, str])
+@app.get("/", tags=["Health"])
+@rate_limit(None)
 async def root():
     """Health check endpoint"""
     return {
         "message": "Know-Flow Learning API is running",
         "version": "2.0.0",
-        "timestamp": datetime.utcnow().isoformat(),
+        "timestamp": _utcnow(),
         "status": "healthy"
     }
 
+# Upper bound on the OpenAI health probe, in seconds
+OPENAI_PROBE_TIMEOUT = 2.0
+
+async def _probe_openai(client: AsyncOpenAI) -> None:
+    """Make a cheap authenticated OpenAI request; raises if the API is unreachable"""
+    await asyncio.wait_for(client.models.list(), timeout=OPENAI_PROBE_TIMEOUT)
+
 @app.get("/health", tags=["Health"], response_model=HealthResponse)
-async def health_check():
+@rate_limit(None)
+async def health_check(request: Request):
     """Detailed health check with enhanced monitoring"""
-    start_time = time.time()
+    now = _utcnow()
+    start_time = time.perf_counter()
     
-    try:
-        # Test Firebase connection
-        db.collection("health").document("test").get()
-        db_status = "connected"
-    except Exception as e:
-        logger.error(f"Database health check failed: {e}")
+    # Probe Firebase and OpenAI at the same time
+    db_result, ai_result = await asyncio.gather(
+        db.collection("health").document("test").get(),
+        _probe_openai(request.app.state.openai),
+        return_exceptions=True
+    )
+    
+    db_status = "connected"
+    if isinstance(db_result, BaseException):
+        logger.error(f"Database health check failed: {db_result}")
         db_status = "disconnected"
     
-    try:
-        # Test AI service (OpenAI)
-        client = AsyncOpenAI(api_key=os.getenv('OPENAI_API_KEY'))
-        ai_status = "connected"
-    except Exception as e:
-        logger.error(f"AI service health check failed: {e}")
+    ai_status = "connected"
+    if isinstance(ai_result, BaseException):
+        logger.error(f"AI service health check failed: {ai_result!r}")
         ai_status = "disconnected"
     
     return HealthResponse(
         status="healthy" if db_status == "connected" and ai_status == "connected" else "degraded",
         database=db_status,
         ai_service=ai_status,
-        timestamp=datetime.utcnow().isoformat(),
+        timestamp=now,
         version="2.0.0",
-        uptime=time.time() - start_time
+        uptime=time.perf_counter() - start_time
+    )
+
+# Users this process has seen with their profile defaults in place, least recently
+# used first, so repeat prompts skip the user read
+INITIALIZED_USERS_SIZE = 10000
+_initialized_users: "OrderedDict[str, None]" = OrderedDict()
+
+def _mark_user_initialized(user_id: str) -> None:
+    _initialized_users[user_id] = None
+    _initialized_users.move_to_end(user_id)
+    if len(_initialized_users) > INITIALIZED_USERS_SIZE:
+        _initialized_users.popitem(last=False)
+
+async def _initialize_user(user_ref, created_at: datetime, learning_style: str) -> None:
+    """Fill in the profile defaults of a user created by a merge upsert"""
+    if user_ref.id in _initialized_users:
+        _initialized_users.move_to_end(user_ref.id)
+        return
+    
+    user_doc = await user_ref.get()
+    if "createdAt" in (user_doc.to_dict() or {}):
+        _mark_user_initialized(user_ref.id)
+        return
+    
+    await user_ref.set({
+        "createdAt": created_at,
+        "learningPreferences": {
+            "learningStyle": learning_style,
+            "difficultyLevel": "beginner",
+            "topicsOfInterest": [],
+            "timeAvailability": 30
+        }
+    }, merge=True)
+    _mark_user_initialized(user_ref.id)
+    logger.info("Created new user: %s", user_ref.id)
+
+async def _persist_prompt(
+    user_id: str,
+    prompt: str,
+    plan_id: str,
+    created_at: datetime,
+    db_client: AsyncClient,
+    context: Optional[Dict[str, Any]] = None,
+    learning_style: str = "adaptive"
+) -> None:
+    """Store an acknowledged prompt, creating the user if needed, and queue it for generation"""
+    try:
+        # All writes for this prompt, committed together in a single round trip
+        batch = db_client.batch()
+        
+        # Upsert the user instead of reading it first; profile defaults must not
+        # overwrite existing preferences, so they are filled in once the prompt is stored
+        user_ref = _user_ref(db_client, user_id)
+        batch.set(user_ref, {"uid": user_id, "lastActive": SERVER_TIMESTAMP}, merge=True)
+        
+        # Store the prompt in Firestore with enhanced metadata
+        prompt_data = {
+            "userId": user_id,
+            "prompt": prompt,
+            "context": context or {},
+            "learningStyle": learning_style,
+            "timestamp": created_at,
+            "status": "queued",
+            "queuedAt": created_at,
+            "planId": plan_id
+        }
+        
+        # Store under the user and in a global prompts collection for analytics
+        batch.set(user_ref.collection("prompts").document(plan_id), prompt_data)
+        batch.set(db_client.collection("prompts").document(plan_id), {
+            **prompt_data,
+            "globalId": plan_id,
+            "analytics": {
+                "processingTime": None,
+                "userSatisfaction": None,
+                "completionRate": None
+            }
+        })
+        await batch.commit()
+        
+        # Generation runs in the plan queue's next batch; results are written back to both prompt documents
+        try:
+            await plan_queue.submit(plan_id, user_id, prompt, context)
+        except RedisError as e:
+            # The prompt is stored as queued, so the queue's Firestore sweep picks it up
+            logger.warning(f"Failed to queue prompt {plan_id}, leaving it for recovery: {e}")
+        
+        await _initialize_user(user_ref, created_at, learning_style)
+        logger.info("Successfully stored prompt %s for user %s", plan_id, user_id)
+    except Exception as e:
+        logger.error(f"Failed to store prompt {plan_id} for user {user_id}: {e}", exc_info=True)
+
+def _process_prompt(
+    user_id: str,
+    prompt: str,
+    db_client: AsyncClient,
+    background_tasks: BackgroundTasks,
+    context: Optional[Dict[str, Any]] = None,
+    learning_style: Optional[str] = None
+) -> UserPromptPostResponse:
+    """Acknowledge a prompt; it is stored after the 202 response has been sent"""
+    logger.info("Processing prompt from user %s: %.100s...", user_id, prompt)
+    
+    # Generate a unique plan ID up front so the client can poll for it
+    plan_id = uuid.uuid4().hex
+    background_tasks.add_task(
+        _persist_prompt,
+        user_id,
+        prompt,
+        plan_id,
+        _utcnow(),
+        db_client,
+        context=context,
+        learning_style=learning_style or "adaptive"
+    )
+    
+    return UserPromptPostResponse.model_construct(
+        success=True,
+        message="Prompt received and queued. AI agents will generate your personalized learning plan shortly.",
+        userId=user_id,
+        prompt=prompt,
+        planId=plan_id,
+        estimatedDuration=15,  # minutes
+        difficulty="adaptive"
     )
 
 # Enhanced GET endpoint with better validation
-@app.get("/api/user-prompt", response_model=UserPromptGetResponse, tags=["Learning"])
+@app.get("/api/user-prompt", status_code=status.HTTP_202_ACCEPTED, tags=["Learning"])
+@rate_limit(capacity=10, window_seconds=60)
 async def get_user_prompt(
     userId: str, 
     prompt: str,
-    db_client: firestore.Client = Depends(get_firestore_client)
+    background_tasks: BackgroundTasks,
+    db_client: AsyncClient = Depends(get_firestore_client)
 ):
-    """Get prompt from user and forward it to the POST endpoint with enhanced validation"""
+    """Get prompt from user and process it the same way as the POST endpoint"""
     
     if not userId or len(userId.strip()) == 0:
         raise HTTPException(
@@ -274,16 +609,7 @@ async def get_user_prompt(
         )
     
     try:
-        logger.info(f"GET received - User: {userId}, Prompt: {prompt[:100]}...")
-        
-        # Create request object for POST endpoint
-        request_data = UserPromptRequest(userId=userId.strip(), prompt=prompt.strip())
-        
-        # Call the POST endpoint internally
-        post_response = await post_user_prompt(request_data, db_client)
-        
-        logger.info(f"POST response generated successfully for user {userId}")
-        return post_response
+        return _process_prompt(userId.strip(), prompt.strip(), db_client, background_tasks)
         
     except Exception as e:
         logger.error(f"Error in GET /api/user-prompt: {e}")
@@ -293,80 +619,41 @@ async def get_user_prompt(
         )
 
 # Enhanced POST endpoint with better error handling and AI integration
-@app.post("/api/user-prompt", response_model=UserPromptPostResponse, tags=["Learning"])
+# The body is parsed and validated in a single pydantic pass from the raw bytes,
+# so the request schema is supplied to the OpenAPI docs explicitly
+@app.post(
+    "/api/user-prompt",
+    response_model=UserPromptPostResponse,
+    status_code=status.HTTP_202_ACCEPTED,
+    tags=["Learning"],
+    openapi_extra={
+        "requestBody": {
+            "content": {"application/json": {"schema": UserPromptRequest.model_json_schema()}},
+            "required": True,
+        }
+    },
+)
+@rate_limit(capacity=10, window_seconds=60)
 async def post_user_prompt(
-    request: UserPromptRequest,
-    db_client: firestore.Client = Depends(get_firestore_client)
+    raw: Request,
+    background_tasks: BackgroundTasks,
+    db_client: AsyncClient = Depends(get_firestore_client)
 ):
     """Receive prompt from frontend partners and generate learning content with enhanced processing"""
     
     try:
-        logger.info(f"Processing prompt from user {request.userId}: {request.prompt[:100]}...")
-        
-        # Validate user exists
-        user_ref = db_client.collection("users").document(request.userId)
-        user_doc = user_ref.get()
-        
-        if not user_doc.exists:
-            # Create user if doesn't exist
-            user_ref.set({
-                "uid": request.userId,
-                "createdAt": datetime.utcnow(),
-                "lastActive": datetime.utcnow(),
-                "learningPreferences": {
-                    "learningStyle": request.learningStyle or "adaptive",
-                    "difficultyLevel": "beginner",
-                    "topicsOfInterest": [],
-                    "timeAvailability": 30
-                }
-            })
-            logger.info(f"Created new user: {request.userId}")
-        
-        # Store the prompt in Firestore with enhanced metadata
-        prompt_data = {
-            "userId": request.userId,
-            "prompt": request.prompt,
-            "context": request.context or {},
-            "learningStyle": request.learningStyle or "adaptive",
-            "timestamp": datetime.utcnow(),
-            "status": "processing",
-            "processingStarted": datetime.utcnow()
-        }
-        
-        # Generate a unique plan ID
-        plan_id = str(uuid.uuid4())
-        prompt_data["planId"] = plan_id
-        
-        # Store in Firestore with better organization
-        user_ref = db_client.collection("users").document(request.userId)
-        prompt_ref = user_ref.collection("prompts").document(plan_id)
-        prompt_ref.set(prompt_data)
-        
-        # Also store in a global prompts collection for analytics
-        global_prompt_ref = db_client.collection("prompts").document(plan_id)
-        global_prompt_ref.set({
-            **prompt_data,
-            "globalId": plan_id,
-            "analytics": {
-                "processingTime": None,
-                "userSatisfaction": None,
-                "completionRate": None
-            }
-        })
-        
-        # TODO: Integrate with enhanced content generation system
-        # For now, acknowledge receipt with estimated processing time
-        
-        logger.info(f"Successfully processed prompt for user {request.userId}")
-        
-        return UserPromptPostResponse(
-            success=True,
-            message="Prompt received and processing started. AI agents are working on your personalized learning plan.",
-            userId=request.userId,
-            prompt=request.prompt,
-            planId=plan_id,
-            estimatedDuration=15,  # minutes
-            difficulty="adaptive"
+        request = UserPromptRequest.model_validate_json(await raw.body())
+    except ValidationError as e:
+        raise RequestValidationError(e.errors())
+    
+    try:
+        return _process_prompt(
+            request.userId,
+            request.prompt,
+            db_client,
+            background_tasks,
+            context=request.context,
+            learning_style=request.learningStyle
         )
         
     except Exception as e:
@@ -376,49 +663,78 @@ async def post_user_prompt(
             detail=f"Failed to process prompt: {str(e)}"
         )
 
-# Enhanced user plans endpoint with pagination and filtering
+async def _read_plans(query) -> List[Dict[str, Any]]:
+    """Plan documents matching query, each with its planId"""
+    return [{**doc.to_dict(), "planId": doc.id} async for doc in query.stream()]
+
+def _encode_plans_cursor(plan: Dict[str, Any]) -> str:
+    """Opaque cursor positioned after plan, carrying its created_at and plan ID"""
+    created_at = plan.get("created_at")
+    is_datetime = isinstance(created_at, datetime)
+    value = created_at.isoformat() if is_datetime else created_at
+    return base64.urlsafe_b64encode(orjson.dumps([value, is_datetime, plan["planId"]])).decode()
+
+def _decode_plans_cursor(cursor: str) -> Tuple[Any, str]:
+    """created_at and plan ID of the plan a cursor from _encode_plans_cursor points after"""
+    try:
+        value, is_datetime, plan_id = orjson.loads(base64.urlsafe_b64decode(cursor))
+        return (datetime.fromisoformat(value) if is_datetime else value), plan_id
+    except (ValueError, TypeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+
+# Enhanced user plans endpoint with cursor pagination and filtering
 @app.get("/api/user/{userId}/plans", tags=["Learning"])
 async def get_user_plans(
     userId: str,
-    status: Optional[str] = None,
-    limit: int = 20,
-    offset: int = 0,
-    db_client: firestore.Client = Depends(get_firestore_client)
+    plan_status: Optional[str] = Query(default=None, alias="status"),
+    limit: int = Query(default=50, ge=1, le=100),
+    cursor: Optional[str] = Query(default=None, description="nextCursor from the previous page"),
+    db_client: AsyncClient = Depends(get_firestore_client)
 ):
-    """Get all learning plans for a user with enhanced filtering and pagination"""
+    """Get a page of learning plans for a user, ordered by creation time"""
     try:
-        user_ref = db_client.collection("users").document(userId)
-        
-        # Check if user exists
-        if not user_ref.get().exists:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="User not found"
-            )
-        
+        user_ref = _user_ref(db_client, userId)
         plans_ref = user_ref.collection("lessonPlans")
         
         # Apply filters
-        query = plans_ref
-        if status:
-            query = query.where("status", "==", status)
+        filtered = plans_ref
+        if plan_status:
+            filtered = filtered.where("status", "==", plan_status)
         
-        # Apply pagination
-        query = query.limit(limit).offset(offset)
+        # Plans sharing a created_at are ordered by ID, so the cursor identifies exactly
+        # one position. Ordering by created_at leaves out plans without one, so the
+        # total is counted over the same ordered query.
+        ordered = filtered.order_by("created_at").order_by(FieldPath.document_id())
         
-        plans = []
-        for doc in query.stream():
-            plan_data = doc.to_dict()
-            plan_data["planId"] = doc.id
-            plans.append(plan_data)
+        # Resume after the last plan of the previous page instead of skipping
+        # over (and paying reads for) every earlier document with an offset
+        query = ordered
+        if cursor:
+            created_at, plan_id = _decode_plans_cursor(cursor)
+            query = query.start_after({
+                "created_at": created_at,
+                FieldPath.document_id(): plans_ref.document(plan_id)
+            })
+        query = query.limit(limit)
         
-        # Get total count for pagination
-        total_query = plans_ref
-        if status:
-            total_query = total_query.where("status", "==", status)
-        total_count = len(list(total_query.stream()))
+        # Check the user, read the page and count the total for pagination at the same time
+        user_doc, plans, total_count = await asyncio.gather(
+            user_ref.get(),
+            _read_plans(query),
+            _count(ordered)
+        )
+        if not user_doc.exists:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="User not found"
+            )
         
-        return {
+        has_more = len(plans) == limit
+        # Returned directly so the plan documents skip jsonable_encoder
+        return FirestoreJSONResponse({
             "success": True,
             "userId": userId,
             "plans": plans,
@@ -426,10 +742,10 @@ async def get_user_plans(
             "total": total_count,
             "pagination": {
                 "limit": limit,
-                "offset": offset,
-                "hasMore": offset + limit < total_count
+                "nextCursor": _encode_plans_cursor(plans[-1]) if has_more else None,
+                "hasMore": has_more
             }
-        }
+        })
         
     except HTTPException:
         raise
@@ -445,12 +761,12 @@ async def get_user_plans(
 async def get_user_analytics(
     userId: str,
     timeframe: str = "30d",  # 7d, 30d, 90d, 1y
-    db_client: firestore.Client = Depends(get_firestore_client)
+    db_client: AsyncClient = Depends(get_firestore_client)
 ):
     """Get comprehensive learning analytics for a user"""
     try:
         # Calculate date range
-        end_date = datetime.utcnow()
+        end_date = _utcnow()
         if timeframe == "7d":
             start_date = end_date - timedelta(days=7)
         elif timeframe == "30d":
@@ -462,35 +778,33 @@ async def get_user_analytics(
         else:
             start_date = end_date - timedelta(days=30)
         
-        user_ref = db_client.collection("users").document(userId)
+        user_ref = _user_ref(db_client, userId)
         
         # Get learning sessions
         sessions_ref = user_ref.collection("studySessions")
         sessions_query = sessions_ref.where("startTime", ">=", start_date)
         
-        sessions = []
-        total_study_time = 0
-        for doc in sessions_query.stream():
-            session_data = doc.to_dict()
-            if session_data.get("duration"):
-                total_study_time += session_data["duration"]
-            sessions.append(session_data)
-        
-        # Get completed lessons
+        # Sessions and plans are only needed as totals, so Firestore computes them
         plans_ref = user_ref.collection("lessonPlans")
-        completed_plans = []
-        for doc in plans_ref.where("status", "==", "completed").stream():
-            completed_plans.append(doc.to_dict())
+        session_totals, completed_count, all_plans_count = await asyncio.gather(
+            _aggregate(
+                sessions_query.count(alias="sessions").sum("duration", alias="study_time")
+            ),
+            _count(plans_ref.where("status", "==", "completed")),
+            _count(plans_ref)
+        )
+        session_count = int(session_totals["sessions"])
+        total_study_time = session_totals["study_time"] or 0
         
         # Calculate analytics
         analytics = {
             "userId": userId,
             "timeframe": timeframe,
             "totalStudyTime": total_study_time,  # minutes
-            "averageSessionLength": total_study_time / len(sessions) if sessions else 0,
-            "totalSessions": len(sessions),
-            "completedPlans": len(completed_plans),
-            "completionRate": len(completed_plans) / len(list(plans_ref.stream())) if plans_ref else 0,
+            "averageSessionLength": total_study_time / session_count if session_count else 0,
+            "totalSessions": session_count,
+            "completedPlans": completed_count,
+            "completionRate": completed_count / all_plans_count if all_plans_count else 0,
             "studyStreak": 0,  # TODO: Implement streak calculation
             "topics": [],  # TODO: Implement topic analysis
             "learningProgress": {
@@ -503,7 +817,7 @@ async def get_user_analytics(
         return {
             "success": True,
             "analytics": analytics,
-            "timestamp": datetime.utcnow().isoformat()
+            "timestamp": end_date
         }
         
     except Exception as e:
@@ -515,13 +829,15 @@ async def get_user_analytics(
 
 if __name__ == "__main__":
     import uvicorn
-    port = int(os.getenv("PORT", 8000))
-    host = os.getenv("HOST", "0.0.0.0")
+    port = config.PORT
+    host = config.HOST
     logger.info(f"Starting Know-Flow API v2.0.0 on {host}:{port}")
     uvicorn.run(
         app, 
         host=host, 
         port=port,
+        loop="uvloop",
+        http="httptools",
         log_level="info",
-        access_log=True
+        access_log=False
     )
\ No newline at end of file
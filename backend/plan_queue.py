@@ -0,0 +1,308 @@
+"""
+Background generation of learning plans for submitted prompts.
+
+Prompts accepted by the API are queued here and generated in batches by a
+long-running task, so the request that submitted a prompt never waits on the agents.
+Batching lets several plans share the bounded concurrency of
+content_generation.batch_generate_plans_async instead of each request starting its
+own pipeline.
+
+With Redis, the queue is a list shared by every worker. Each worker moves the prompts
+it takes into its own processing list and keeps a heartbeat key alive; prompts held
+by a worker whose heartbeat has expired are returned to the queue. Without Redis,
+each worker queues in memory and, on startup, picks up the prompts that Firestore
+still shows as queued or as stuck processing. With Redis, workers also sweep Firestore
+every processing_timeout_seconds for prompts that have been queued or processing for
+that long, which catches prompts that were stored but never reached the Redis list.
+
+Every prompt is claimed in a Firestore transaction before it is generated, so a
+prompt that ends up queued twice is only generated once.
+"""
+import asyncio
+import logging
+import sys
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+
+import orjson
+from google.cloud.firestore import SERVER_TIMESTAMP, async_transactional
+
+if TYPE_CHECKING:
+    from google.cloud.firestore import AsyncClient, AsyncTransaction
+    from redis.asyncio import Redis
+
+logger = logging.getLogger(__name__)
+
+
+class PlanQueue:
+    """Collects queued prompts and generates them batch_size at a time.
+
+    A batch is started as soon as it is full, or max_wait_seconds after its first
+    prompt arrived. Results are written back to both copies of the prompt document.
+    A prompt left processing for longer than processing_timeout_seconds is assumed
+    to belong to a worker that died, and may be claimed again.
+    """
+
+    PENDING_KEY = "plan_queue:pending"
+    PROCESSING_KEY = "plan_queue:processing:"
+    HEARTBEAT_KEY = "plan_queue:alive:"
+    HEARTBEAT_SECONDS = 10
+
+    # Pause after a batch fails outright, so an unavailable database is not retried in a tight loop
+    RETRY_DELAY_SECONDS = 5
+
+    def __init__(
+        self,
+        db: "AsyncClient",
+        batch_size: int,
+        max_wait_seconds: float,
+        processing_timeout_seconds: float
+    ):
+        self.db = db
+        self.batch_size = batch_size
+        self.max_wait_seconds = max_wait_seconds
+        self.processing_timeout_seconds = processing_timeout_seconds
+        self._redis: Optional["Redis"] = None
+        self._queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue()
+        self._worker_id = uuid.uuid4().hex
+        # Prompts this worker has claimed and not yet written back, by plan_id
+        self._in_flight: Dict[str, Dict[str, Any]] = {}
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def _processing_key(self) -> str:
+        return self.PROCESSING_KEY + self._worker_id
+
+    @property
+    def _heartbeat_key(self) -> str:
+        return self.HEARTBEAT_KEY + self._worker_id
+
+    async def start(self, redis: Optional["Redis"] = None) -> None:
+        """Recover prompts left unfinished by stopped workers, then start generating.
+
+        The Redis client is used for blocking list commands, so it must not have a
+        socket timeout shorter than max_wait_seconds.
+        """
+        self._redis = redis
+        try:
+            if redis is not None:
+                await redis.set(self._heartbeat_key, 1, ex=self.HEARTBEAT_SECONDS * 3)
+                await self._recover_redis()
+                await self._recover_firestore(queued_before=self._stale_before())
+            else:
+                await self._recover_firestore()
+        except Exception as e:
+            logger.error(f"Failed to recover queued learning plans: {e}", exc_info=True)
+
+        if redis is not None:
+            self._tasks.append(asyncio.create_task(self._heartbeat()))
+        self._tasks.append(asyncio.create_task(self._run()))
+
+    async def stop(self) -> None:
+        """Stop generating and return unfinished prompts to the queue."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        try:
+            if self._in_flight:
+                await self._write_status(list(self._in_flight.values()), {"status": "queued"})
+                logger.info(f"Returned {len(self._in_flight)} unfinished learning plans to the queue")
+                self._in_flight = {}
+            if self._redis is not None:
+                await self._release()
+                await self._redis.delete(self._heartbeat_key)
+        except Exception as e:
+            logger.error(f"Failed to return unfinished learning plans to the queue: {e}", exc_info=True)
+
+        # Only imported by _generate, so there is no pool to close if nothing was generated
+        content_generation = sys.modules.get("content_generation")
+        if content_generation is not None:
+            await content_generation.close_http_client()
+
+    async def submit(self, plan_id: str, user_id: str, prompt: str, context: Optional[Dict[str, Any]] = None) -> None:
+        """Queue a stored prompt for generation."""
+        item = {"plan_id": plan_id, "user_id": user_id, "prompt": prompt, "context": context}
+        if self._redis is not None:
+            await self._redis.lpush(self.PENDING_KEY, orjson.dumps(item))
+        else:
+            self._queue.put_nowait(item)
+
+    async def _run(self) -> None:
+        while True:
+            batch = []
+            try:
+                batch = await self._next_batch()
+                await self._generate(batch)
+            except Exception as e:
+                logger.error(f"Failed to generate a batch of {len(batch)} learning plans: {e}", exc_info=True)
+                await self._retry_later(batch)
+
+    async def _retry_later(self, batch: List[Dict[str, Any]]) -> None:
+        await asyncio.sleep(self.RETRY_DELAY_SECONDS)
+        try:
+            # Claimed prompts must be queued again, or the claim would skip them
+            if self._in_flight:
+                await self._write_status(list(self._in_flight.values()), {"status": "queued"})
+                self._in_flight = {}
+            if self._redis is not None:
+                await self._release()
+            else:
+                for item in batch:
+                    self._queue.put_nowait(item)
+        except Exception as e:
+            logger.error(f"Failed to requeue learning plans: {e}", exc_info=True)
+
+    async def _next_batch(self) -> List[Dict[str, Any]]:
+        loop = asyncio.get_running_loop()
+        batch = [await self._get(None)]
+        deadline = loop.time() + self.max_wait_seconds
+        while len(batch) < self.batch_size:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            item = await self._get(remaining)
+            if item is None:
+                break
+            batch.append(item)
+        return batch
+
+    async def _get(self, timeout: Optional[float]) -> Optional[Dict[str, Any]]:
+        """Next queued prompt, or None if none arrives within timeout seconds."""
+        if self._redis is None:
+            try:
+                return await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                return None
+
+        # A timeout of 0 blocks until a prompt is queued
+        raw = await self._redis.blmove(self.PENDING_KEY, self._processing_key, timeout or 0, src="RIGHT", dest="LEFT")
+        return None if raw is None else orjson.loads(raw)
+
+    async def _release(self) -> None:
+        """Move everything in this worker's processing list back to the pending list."""
+        while await self._redis.lmove(self._processing_key, self.PENDING_KEY, "LEFT", "RIGHT") is not None:
+            pass
+
+    async def _heartbeat(self) -> None:
+        loop = asyncio.get_running_loop()
+        next_sweep = loop.time() + self.processing_timeout_seconds
+        while True:
+            await asyncio.sleep(self.HEARTBEAT_SECONDS)
+            try:
+                await self._redis.set(self._heartbeat_key, 1, ex=self.HEARTBEAT_SECONDS * 3)
+                await self._recover_redis()
+                if loop.time() >= next_sweep:
+                    next_sweep = loop.time() + self.processing_timeout_seconds
+                    await self._recover_firestore(queued_before=self._stale_before())
+            except Exception as e:
+                logger.warning(f"Plan queue heartbeat failed: {e}")
+
+    async def _recover_redis(self) -> None:
+        """Return prompts held by workers whose heartbeat has expired to the pending list."""
+        recovered = 0
+        async for key in self._redis.scan_iter(match=self.PROCESSING_KEY + "*"):
+            worker_id = key.decode()[len(self.PROCESSING_KEY):]
+            if await self._redis.exists(self.HEARTBEAT_KEY + worker_id):
+                continue
+            while await self._redis.lmove(key, self.PENDING_KEY, "LEFT", "RIGHT") is not None:
+                recovered += 1
+        if recovered:
+            logger.info(f"Requeued {recovered} learning plans from stopped workers")
+
+    async def _recover_firestore(self, queued_before: Optional[datetime] = None) -> None:
+        """Queue the prompts left queued, or stuck processing, by stopped workers.
+
+        Only prompts queued before queued_before are taken, if it is given; with Redis,
+        newer ones are still expected to be on the pending list. Every worker queues
+        all of them; the claim makes sure each is generated once.
+        """
+        prompts_ref = self.db.collection("prompts")
+        queued = prompts_ref.where("status", "==", "queued")
+        if queued_before is not None:
+            queued = queued.where("queuedAt", "<", queued_before)
+        queries = [
+            queued,
+            prompts_ref.where("status", "==", "processing").where("processingStarted", "<", self._stale_before()),
+        ]
+        recovered = 0
+        for query in queries:
+            async for doc in query.stream():
+                data = doc.to_dict()
+                await self.submit(doc.id, data["userId"], data["prompt"], data.get("context") or None)
+                recovered += 1
+        if recovered:
+            logger.info(f"Requeued {recovered} unfinished learning plans")
+
+    def _stale_before(self) -> datetime:
+        return datetime.now(timezone.utc) - timedelta(seconds=self.processing_timeout_seconds)
+
+    def _prompt_refs(self, item: Dict[str, Any]):
+        """The global and the per-user prompt document of a queued prompt."""
+        user_ref = self.db.collection("users").document(item["user_id"])
+        return (
+            self.db.collection("prompts").document(item["plan_id"]),
+            user_ref.collection("prompts").document(item["plan_id"]),
+        )
+
+    async def _claim(self, item: Dict[str, Any]) -> bool:
+        """Mark a prompt as processing; False if it is gone or another worker has it."""
+        prompt_ref, user_prompt_ref = self._prompt_refs(item)
+        stale_before = self._stale_before()
+
+        @async_transactional
+        async def claim(transaction: "AsyncTransaction") -> bool:
+            snapshot = await prompt_ref.get(transaction=transaction)
+            data = snapshot.to_dict() or {}
+            status = data.get("status")
+            started = data.get("processingStarted")
+            if status != "queued" and not (status == "processing" and started and started < stale_before):
+                return False
+            update = {"status": "processing", "processingStarted": SERVER_TIMESTAMP}
+            transaction.update(prompt_ref, update)
+            transaction.set(user_prompt_ref, update, merge=True)
+            return True
+
+        return await claim(self.db.transaction())
+
+    async def _write_status(self, items: List[Dict[str, Any]], update: Dict[str, Any]) -> None:
+        batch = self.db.batch()
+        for item in items:
+            prompt_ref, user_prompt_ref = self._prompt_refs(item)
+            batch.set(prompt_ref, update, merge=True)
+            batch.set(user_prompt_ref, update, merge=True)
+        await batch.commit()
+
+    async def _generate(self, items: List[Dict[str, Any]]) -> None:
+        # Imported here so the API only loads the agents once there is work for them
+        from content_generation import batch_generate_plans_async
+
+        claims = await asyncio.gather(*(self._claim(item) for item in items))
+        claimed = [item for item, is_claimed in zip(items, claims) if is_claimed]
+        if claimed:
+            self._in_flight = {item["plan_id"]: item for item in claimed}
+            logger.info(f"Generating {len(claimed)} queued learning plans")
+            results = await batch_generate_plans_async(claimed, max_concurrency=self.batch_size)
+
+            batch = self.db.batch()
+            for item, result in zip(claimed, results):
+                update = {
+                    "status": "completed" if result.get("success") else "failed",
+                    "lessonPlanId": result.get("plan_id"),
+                    "error": result.get("error"),
+                    "processingCompleted": SERVER_TIMESTAMP,
+                }
+                prompt_ref, user_prompt_ref = self._prompt_refs(item)
+                batch.set(user_prompt_ref, update, merge=True)
+                batch.set(prompt_ref, {
+                    **update,
+                    "analytics": {"processingTime": result.get("processing_time")},
+                }, merge=True)
+            await batch.commit()
+            self._in_flight = {}
+
+        if self._redis is not None:
+            # Every prompt taken for this batch is now written back or skipped
+            await self._redis.delete(self._processing_key)
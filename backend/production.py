@@ -14,7 +14,7 @@ PRODUCTION_CONFIG: Dict[str, Any] = {
     
     # Logging
     "log_level": "info",
-    "access_log": True,
+    "access_log": os.getenv("ACCESS_LOG", "false").lower() == "true",
     "error_log": True,
     
     # Security
@@ -132,13 +132,5 @@ proc_name = "knowflow-backend"
 backlog = 2048
 reuse_port = True
 
-# Worker processes
-worker_class = "uvicorn.workers.UvicornWorker"
-worker_connections = 1000
-max_requests = 1000
-max_requests_jitter = 100
-timeout = 120
-keepalive = 2
-
 # Logging format
 access_log_format = '%(h)s %(l)s %(u)s %(t)s "%(r)s" %(s)s %(b)s "%(f)s" "%(a)s" %(D)s'
@@ -0,0 +1,198 @@
+"""
+Rate limiting for the Know-Flow API.
+
+RedisTokenBucket enforces one shared token bucket per client across every worker
+process; main.rate_limit_middleware falls back to LocalTokenBucket, which applies the
+same algorithm within a single process, when Redis is not configured or cannot be
+reached. OpenAIRateLimiter paces outgoing model calls to stay under the account's
+request and token limits.
+
+Routes decorated with rate_limit get their own bucket per client, or are exempt.
+"""
+import asyncio
+import math
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, AsyncIterator, Callable, Optional, Tuple, TypeVar
+
+if TYPE_CHECKING:
+    from redis.asyncio import Redis
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+# Refills the bucket for the elapsed time, then takes one token if available.
+# Returns {allowed, retry_after_ms}. The key expires once a full bucket would have
+# refilled, so idle clients cost no memory.
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now_ms = tonumber(ARGV[3])
+
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'last_refill_ms')
+local tokens = tonumber(state[1]) or capacity
+local last_refill_ms = tonumber(state[2]) or now_ms
+
+tokens = math.min(capacity, tokens + math.max(0, now_ms - last_refill_ms) * rate / 1000)
+
+local allowed = 0
+local retry_after_ms = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+else
+    retry_after_ms = math.ceil((1 - tokens) * 1000 / rate)
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'last_refill_ms', now_ms)
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity * 1000 / rate))
+return {allowed, retry_after_ms}
+"""
+
+
+@dataclass(frozen=True)
+class RouteLimit:
+    """Token bucket parameters for a route; a capacity of None exempts it."""
+    capacity: Optional[int]
+    window_seconds: float = 60
+
+
+def rate_limit(capacity: Optional[int], window_seconds: float = 60) -> Callable[[F], F]:
+    """Limit an endpoint with its own bucket of capacity requests per window_seconds.
+
+    Clients get a separate bucket for each route path, so traffic to one endpoint does
+    not use up the budget of another. Pass capacity=None to exempt the endpoint.
+    """
+
+    def decorator(endpoint: F) -> F:
+        endpoint.__rate_limit__ = RouteLimit(capacity, window_seconds)
+        return endpoint
+
+    return decorator
+
+
+class RedisTokenBucket:
+    """Token bucket shared by all workers, stored as one Redis hash per client."""
+
+    def __init__(self, redis: "Redis", capacity: int, window_seconds: float, prefix: str = "ratelimit:"):
+        self.capacity = capacity
+        self.rate = capacity / window_seconds  # tokens per second
+        self.prefix = prefix
+        # register_script runs EVALSHA and loads the script on first use
+        self._script = redis.register_script(TOKEN_BUCKET_SCRIPT)
+
+    async def allow(self, client_id: str) -> Tuple[bool, float]:
+        """Take a token for client_id.
+
+        Returns:
+            Whether the request is allowed, and the seconds until a token is available
+        """
+        allowed, retry_after_ms = await self._script(
+            keys=[self.prefix + client_id],
+            args=[self.capacity, self.rate, math.floor(time.time() * 1000)],
+        )
+        return bool(allowed), retry_after_ms / 1000
+
+
+class LocalTokenBucket:
+    """Per-process token buckets, kept in least recently seen order.
+
+    Memory is bounded by max_clients; a client whose bucket has refilled completely
+    is indistinguishable from a new one, so its entry can be dropped.
+    """
+
+    # Refilled entries removed per call, so cleanup never scans the whole table
+    MAX_EVICTIONS = 8
+
+    def __init__(self, capacity: int, window_seconds: float, max_clients: int = 16384):
+        self.capacity = capacity
+        self.rate = capacity / window_seconds  # tokens per second
+        self.max_clients = max_clients
+        # client_id -> (tokens, last_refill)
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def allow(self, client_id: str) -> Tuple[bool, float]:
+        """Take a token for client_id.
+
+        Returns:
+            Whether the request is allowed, and the seconds until a token is available
+        """
+        now = time.monotonic()
+        refill_seconds = self.capacity / self.rate
+
+        for _ in range(self.MAX_EVICTIONS):
+            if not self._buckets:
+                break
+            _, last_refill = next(iter(self._buckets.values()))
+            if now - last_refill < refill_seconds:
+                break
+            self._buckets.popitem(last=False)
+
+        bucket = self._buckets.get(client_id)
+        if bucket is None:
+            if len(self._buckets) >= self.max_clients:
+                self._buckets.popitem(last=False)
+            tokens = float(self.capacity)
+        else:
+            tokens, last_refill = bucket
+            tokens = min(self.capacity, tokens + (now - last_refill) * self.rate)
+
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        self._buckets[client_id] = (tokens, now)
+        self._buckets.move_to_end(client_id)
+        return allowed, 0.0 if allowed else (1 - tokens) / self.rate
+
+
+class _AsyncTokenBucket:
+    """Token bucket whose acquire waits, in arrival order, until enough tokens refill."""
+
+    def __init__(self, capacity: float, window_seconds: float):
+        self.capacity = capacity
+        self.rate = capacity / window_seconds  # tokens per second
+        self._tokens = capacity
+        self._last_refill = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, amount: float) -> None:
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.rate)
+                self._last_refill = now
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+                await asyncio.sleep((amount - self._tokens) / self.rate)
+
+
+class OpenAIRateLimiter:
+    """Preemptive limiter for OpenAI calls.
+
+    Each call reserves one request from the requests-per-minute budget and its estimated
+    prompt plus completion tokens from the tokens-per-minute budget, then waits for one
+    of max_concurrent_requests slots. Pacing calls up front avoids bursts of 429s and
+    the retry storms they cause.
+
+    Its asyncio primitives belong to the event loop that first waits on them, so use one
+    limiter per loop.
+    """
+
+    def __init__(self, max_concurrent_requests: int, requests_per_minute: int, tokens_per_minute: int):
+        self._semaphore = asyncio.Semaphore(max_concurrent_requests)
+        self._requests = _AsyncTokenBucket(requests_per_minute, 60)
+        self._tokens = _AsyncTokenBucket(tokens_per_minute, 60)
+
+    @asynccontextmanager
+    async def reserve(self, estimated_tokens: int) -> AsyncIterator[None]:
+        """Wait for request and token budget and a free slot, holding the slot inside the block."""
+        await self._requests.acquire(1)
+        await self._tokens.acquire(estimated_tokens)
+        async with self._semaphore:
+            yield
@@ -0,0 +1,52 @@
+"""
+Google search tools with an in-process result cache for the research agent.
+
+Imported lazily by content_generation.get_research_agent so that agno is only
+loaded when research actually runs.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Tuple
+
+from agno.tools.googlesearch import GoogleSearchTools
+
+# Number of distinct searches kept in memory
+SEARCH_CACHE_SIZE = 2048
+
+_search_cache: "OrderedDict[Tuple[str, int, str], str]" = OrderedDict()
+_search_cache_lock = threading.Lock()
+
+
+def _query_key(query: str) -> str:
+    """Hash a normalized query so equivalent searches share a cache entry."""
+    return hashlib.blake2b(query.strip().lower().encode(), digest_size=16).hexdigest()
+
+
+class CachedGoogleSearchTools(GoogleSearchTools):
+    """GoogleSearchTools that reuses results for repeated queries."""
+
+    def google_search(self, query: str, max_results: int = 5, language: str = "en") -> str:
+        """Use this function to search Google for a query.
+
+        Args:
+            query (str): The query to search for.
+            max_results (int, optional): The maximum number of results to return. Default is 5.
+            language (str, optional): The language of the search results. Default is "en".
+
+        Returns:
+            str: A JSON formatted string containing the search results.
+        """
+        key = (_query_key(query), max_results, language)
+        with _search_cache_lock:
+            if key in _search_cache:
+                _search_cache.move_to_end(key)
+                return _search_cache[key]
+
+        result = super().google_search(query, max_results=max_results, language=language)
+
+        with _search_cache_lock:
+            _search_cache[key] = result
+            if len(_search_cache) > SEARCH_CACHE_SIZE:
+                _search_cache.popitem(last=False)
+        return result
@@ -39,7 +39,10 @@ def main():
             app,
             host=config.HOST,
             port=config.PORT,
-            log_level="info" if config.DEBUG else "warning"
+            loop="uvloop",
+            http="httptools",
+            log_level="info" if config.DEBUG else "warning",
+            access_log=False
         )
         
     except ValueError as e: